@@ -1,4 +1,7 @@
 '''Package containing all code related to learning algorithms'''
 from .agents import QAgent, TD0Agent, SARSAAgent
-from .masks import Mask_rxcx4
+from .masks import Mask_rxcx4, NTupleMask, migrateTable
+from .bitboard import BitGame
+from .search import SearchPlayer
+from .evaluation import evaluate
 from .examples import example1
@@ -1,96 +1,75 @@
 '''Code relating to the learning agents'''
-import csv
-import cv2
-import imageio
-import matplotlib.pyplot as plt
+import itertools
 import numpy
+import os
 import pickle
-import random
+import time
 from abc import ABC, abstractmethod
-from .game import Game
-
-
-def randArgMax(a):
-    '''Returns the argmax of the array. Ties are broken radnomly.'''
-    return numpy.argmax(numpy.random.random(numpy.shape(a))*(a==numpy.max(a)))
-
-
-def makeImage(score, state, board_size=4, graphic_size=750, top_margin=40,
-              seperator_width=12):
-    '''Construct the image for a game state
+from .batch import BatchGame, moveBoards, packStates, unpackBoards
+from .bitboard import BitGame, afterstates, legal_actions, pack
+from .checkpoint import Checkpointer, readCheckpoint
+from .game import legal_action_list
+from .parallel import trainParallel
+from .masks import EvaluationCache
+from .persistence import saveTable, loadTable
+from .profiling import PHASES
+from .replay import ReplayReader, spawnByte
+from .rng import makeRandom
+from .stores import Store, makeStore
+from .telemetry import makeRecords, openLogger, readLog, rollingAverage
+
+
+def __getattr__(name):
+    '''Forward makeImage, which moved to rendering, without importing OpenCV
+    until it is used'''
+    if name == 'makeImage':
+        from .rendering import makeImage
+        return makeImage
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
+
+
+def randArgMax(a, axis=None, rng=None):
+    '''Returns the argmax of the array. Ties are broken radnomly.
     input:
-        score: Score of the game
-        state: Board state
-        board_size: Number of tiles in one side of board
-        graphic_size: Size of graphic
-        top_margin: Size of top margin
-        seperator_width: Seperation between tiles in graphic
-    output: Image for a game state'''
-    img = numpy.full((graphic_size + top_margin, graphic_size, 3), 255,
-                     numpy.uint8)
-    # Define colors
-    background_color = (146, 135, 125)
-    color = {0:(158, 148, 138), 1:(238, 228, 218), 2:(237, 224, 200),
-             3:(242, 177, 121), 4:(245, 149, 99), 5:(246, 124, 95), 
-             6:(246, 94, 59), 7:(237, 207, 114), 8:(237, 204, 97), 
-             9:(237, 200, 80), 10:(237, 197, 63), 11:(237, 197, 63), 
-             12:(62, 237, 193), 13:(62, 237, 193), 14:(62,64,237), 
-             15:(140,62,237)}
-    #Set font
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    # Define spacing of tiles
-    spacing = int((graphic_size-seperator_width)/board_size)
-    # Write score at top of screen
-    text = 'The score is ' + str(score)
-    textsize = cv2.getTextSize(text, font, 0.5, 1)[0]
-    cv2.putText(img,text,(int((graphic_size-textsize[0])/2),
-                          int((3*top_margin/4+textsize[1])/2)),
-                font,0.5,(0,0,0),1,cv2.LINE_AA)
-    # Draw squares
-    for i in range(4):
-        for k in range(4):
-            cv2.rectangle(img,
-                          (int(seperator_width/2)+k*spacing,
-                           int(top_margin+seperator_width/2)+i*spacing),
-                          (int(seperator_width/2)+(k+1)*spacing,
-                           int(top_margin+seperator_width/2)+(i+1)*spacing),
-                          color[state[i][k]], -1)
-            if state[i][k] == 0:
-                text = ''
-            else:
-                text = str(2**state[i][k])
-            textsize = cv2.getTextSize(text, font, 0.5, 2)[0]
-            cv2.putText(img,text,
-                        (int(seperator_width/2+k*spacing+(spacing-textsize[0])/2),
-                         int(top_margin+seperator_width/2+i*spacing+(spacing+textsize[1])/2)),
-                        font,0.5,(0,0,0),2,cv2.LINE_AA)
-            cv2.putText(img,text,(int(seperator_width/2+k*spacing+(spacing-textsize[0])/2),
-                                  int(top_margin+seperator_width/2+i*spacing+(spacing+textsize[1])/2)),
-                        font,0.5,(255,255,255),1,cv2.LINE_AA)
-    # Draw outline grid
-    for i in range(5):
-        cv2.line(img, 
-                (int(seperator_width/2)+i*spacing,int(top_margin+seperator_width/2)),
-                (int(seperator_width/2)+i*spacing,int(graphic_size+top_margin-seperator_width/2)), 
-                 background_color, seperator_width)
-    for i in range(5):
-        cv2.line(img,
-                 (int(seperator_width/2),int(top_margin+seperator_width/2)+i*spacing),
-                 (int(graphic_size-seperator_width/2),int(top_margin+seperator_width/2)+i*spacing),
-                 background_color,seperator_width)
-    return img
+        a: Array
+        axis: Axis to take the argmax along. If None of the flattened array.
+        rng: rng.RandomBuffer to break ties with. If None use numpy.random.'''
+    a = numpy.asarray(a)
+    if rng is None:
+        random = numpy.random.random(a.shape)
+    else:
+        random = rng.randoms(a.size).reshape(a.shape)
+    if axis is None:
+        return numpy.argmax(random*(a==a.max()))
+    return numpy.argmax(random*(a==a.max(axis=axis, keepdims=True)),
+                        axis=axis)
 
 
 class Agent(ABC):
     '''Abstract class defining required functions for an agent'''
 
-    def __init__(self, mask, name):
+    # Number of values per tuple num in the look up table, None for one
+    _tableWidth = None
+
+    def __init__(self, mask, name, rng=None):
         '''Initialize the agent
         input:
             mask: Mask used to understand the game
-            name: Name of agent. Used in tag.'''
+            name: Name of agent. Used in tag.
+            rng: numpy.random.Generator or seed for exploration, tie breaking
+                 and the games the agent plays'''
         self.mask = mask
         self.name = name
+        self.seed(rng)
+        # Tuple nums of the states looked at last
+        self._cache = EvaluationCache(mask)
+
+    def seed(self, rng=None):
+        '''Replace the random numbers of the agent
+        input:
+            rng: numpy.random.Generator, seed or rng.RandomBuffer. If None
+                 seed from the operating system.'''
+        self._random = makeRandom(rng)
 
     @abstractmethod
     def learn(self, prevState, action, state, reward):
@@ -111,39 +90,118 @@ class Agent(ABC):
         output: Next action to take'''
         pass
 
-    def play(self, verbose=False):
+    def chooseActions(self, states, available):
+        '''Choose next action for a batch of games. Calls chooseAction for
+        each game; agents can override it with a vectorized version.
+        input:
+            states: (N, 4, 4) array of current states
+            available: (N, 4) boolean array of available actions
+        output: (N,) array of next actions'''
+        actions = numpy.zeros(len(states), dtype=numpy.int64)
+        for i in range(len(states)):
+            actions[i] = self.chooseAction(states[i],
+                                           list(numpy.flatnonzero(available[i])))
+        return actions
+
+    def learnBatch(self, prevStates, actions, states, rewards):
+        '''Learn from a batch of transitions. The tuple nums of all states
+        are computed at once, then learn is called for each transition, so
+        every transition sees the updates of the ones before it.
+        input:
+            prevStates: (N, 4, 4) array of states before actions are taken
+            actions: (N,) array of actions taken
+            states: (N, 4, 4) array of states after actions are taken
+            rewards: (N,) array of rewards recieved from actions'''
+        prevNums = self.mask.getTupleNums(prevStates)
+        nums = self.mask.getTupleNums(states)
+        for i in range(len(actions)):
+            # learn finds the tuple nums in the cache
+            self._cache.add(prevStates[i], prevNums[i])
+            self._cache.add(states[i], nums[i])
+            self.learn(prevStates[i], actions[i], states[i], rewards[i])
+
+    def learnMinibatch(self, prevStates, actions, states, rewards):
+        '''Learn from a minibatch of transitions at once, as train_offline
+        does. Unlike learnBatch the transitions do not see each other's
+        updates. Calls learnBatch; agents can override it with a vectorized
+        version.
+        input:
+            prevStates: (N, 4, 4) array of states before actions are taken
+            actions: (N,) array of actions taken
+            states: (N, 4, 4) array of states after actions are taken
+            rewards: (N,) array of rewards recieved from actions'''
+        self.learnBatch(prevStates, actions, states, rewards)
+
+    def play(self, verbose=False, game=None, learn=True, recorder=None,
+             profiler=None):
         """Agent plays a single game
            Based on the code from georgwiese:https://github.com/georgwiese/2048-rl
         input:
             verbose: If verbose is true also return game states and scores
+            game: Game to play. If None start a new one.
+            learn: If false play without learning, leaving the look up table
+                   untouched
+            recorder: replay.ReplayWriter to record the game to. Needs a
+                      bitboard.BitGame.
+            profiler: profiling.PlayProfiler to time the phases of every
+                      move with. If None nothing is timed.
         output:
             final score and log if verbose is set to true"""
-        game = Game()
+        if game is None:
+            game = BitGame(rng=self._random)
+        # Phases of a move, timed if there is a profiler
+        phases = (self.chooseAction, game.do_action, self.learn,
+                  game.add_random_tile, game.legal_actions)
+        if profiler is not None:
+            profiler.startGame()
+            phases = [profiler.wrap(phase, function)
+                      for phase, function in zip(PHASES, phases)]
+        chooseAction, doAction, learnMove, addRandomTile, legalActions = phases
+        # The table may have changed since the last game
+        self._cache.invalidate()
         # record previous state to update learning algorithm
         prevState = game.state().copy()
-        # whether or not game has reached a gameover state
-        game_over = game.game_over()
+        # Bitmask of the available actions, zero once the game is over
+        legal = legalActions()
         # If verbose record a log of game states and scores
         if verbose:
             log = []
             log.append([game.score(), game.state().copy()])
-        while not game_over:
+        while legal:
             # Choose next action
-            next_action = self.chooseAction(game.state().copy(),
-                                            game.available_actions())
+            next_action = chooseAction(game.state().copy(),
+                                       legal_action_list(legal))
+            # Remember the board before the action for the recorder
+            if recorder is not None:
+                board = game.board()
             # Perform action and recieve a reward
-            reward = game.do_action(next_action)
+            reward = doAction(next_action)
             # Update learning algorithm
-            self.learn(prevState, next_action, game.state().copy(), reward)
+            if learn:
+                learnMove(prevState, next_action, game.state().copy(), reward)
             # Update prevState
             prevState = game.state().copy()
             # Add random tile to state
-            game.add_random_tile()
+            if isinstance(game, BitGame):
+                afterstate = game.board()
+                addRandomTile()
+                spawn = spawnByte(afterstate, game.board())
+                # Only the spawned cell changed, so the tuple nums of the new
+                # state can be updated from those of the afterstate
+                self._cache.expect(prevState, game.state(), [spawn >> 4])
+                if recorder is not None:
+                    recorder.record(board, next_action, spawn)
+            else:
+                addRandomTile()
             # If verbose add new state and score to log
             if verbose:
                 log.append([game.score(), game.state().copy()])
             # Check if game is over
-            game_over = game.game_over()
+            legal = legalActions()
+        if profiler is not None:
+            profiler.endGame()
+        if recorder is not None:
+            recorder.endGame(game.board(), game.score())
         # If verbose return final score and log
         if verbose:
             return game.score(), log
@@ -151,132 +209,488 @@ class Agent(ABC):
         else:
             return game.score()
 
-    def train(self, numIterations=1000, logFile=None, _mode='w'):
+    def train(self, numIterations=1000, logFile=None, _mode='w', rng=None,
+              logger=None, checkpoint_every=None, checkpoint_dir=None,
+              recorder=None, profiler=None):
         """Train agent over many games 
         input:
             numIterations: Number of games to play
-            logFile: logFile to record final game scores. If false, doesn't
-                     record to a file
+            logFile: logFile to stream a record of every game to (see
+                     telemetry). If None, doesn't record to a file
             _mode: Mode to write to the logFile
+            rng: numpy.random.Generator or seed to reseed the agent with
+                 before training. If None keep drawing from the agent's.
+            logger: telemetry.GameLogger to stream the records to instead of
+                    logFile. It is not closed.
+            checkpoint_every: Write a checkpoint every checkpoint_every games
+                              (see checkpoint). If None, doesn't checkpoint.
+            checkpoint_dir: Directory to write the checkpoints to. An
+                            interrupted run continues with resume.
+            recorder: replay.ReplayWriter to record every game to. It is not
+                      closed.
+            profiler: profiling.PlayProfiler to time the moves of every game
+                      with (see play)
+        output:
+            final score of games"""
+        if rng is not None:
+            self.seed(rng)
+        logger, ownLogger = self._openLogger(logFile, _mode, logger)
+        checkpointer = None
+        if checkpoint_every is not None:
+            checkpointer = Checkpointer(checkpoint_dir, checkpoint_every,
+                                        numIterations,
+                                        logFile if ownLogger else None)
+        return self._train(0, numIterations, logger, ownLogger, checkpointer,
+                           recorder, profiler)
+
+    def resume(self, checkpoint_dir, logger=None):
+        """Continue a run of train from its last checkpoint. The agent has to
+        use the same mask as the checkpointed one. Records the log file got
+        after the checkpoint are dropped, so the log matches an
+        uninterrupted run.
+        input:
+            checkpoint_dir: Checkpoint directory of the run
+            logger: telemetry.GameLogger to stream the records to instead of
+                    the log file of the run. It is not closed.
+        output:
+            final score of the games played after the checkpoint"""
+        state, tuples = readCheckpoint(checkpoint_dir)
+        if state['mask'] != self.mask.getTag():
+            raise ValueError(checkpoint_dir + ' was written with mask ' +
+                             state['mask'] + ' but the agent uses mask ' +
+                             self.mask.getTag())
+        self.tuples = tuples
+        self.clearCache()
+        self._random.setState(state['rng'])
+        logFile = None
+        if logger is None and state['log_file'] is not None:
+            logFile = state['log_file']
+            os.truncate(logFile, state['log_offset'])
+        logger, ownLogger = self._openLogger(logFile, 'a', logger)
+        checkpointer = Checkpointer(checkpoint_dir, state['checkpoint_every'],
+                                    state['num_iterations'], logFile)
+        return self._train(state['games'], state['num_iterations'], logger,
+                           ownLogger, checkpointer)
+
+    def _train(self, start, numIterations, logger, ownLogger, checkpointer,
+               recorder=None, profiler=None):
+        """Play the games start to numIterations of a run of train
+        input:
+            start: Number of games of the run already played
+            numIterations: Number of games of the run
+            logger: telemetry.GameLogger or None
+            ownLogger: If true close the logger when done
+            checkpointer: checkpoint.Checkpointer or None
+            recorder: replay.ReplayWriter or None
+            profiler: profiling.PlayProfiler or None
         output:
             final score of games"""
         # Initialize score array
-        scores = numpy.zeros(numIterations, dtype=numpy.int32)
-        # For every game
-        for i in range(numIterations):
-            # Play game and record score
-            scores[i] = self.play(verbose=False)
-        # If logfile is not none write to the logFile
-        if logFile is not None:
-            with open(logFile, mode=_mode) as log_File:
-                writer = csv.writer(log_File, delimiter='\n',
-                                    lineterminator='\n', quoting=csv.QUOTE_NONE)
-                writer.writerow(scores)
+        scores = numpy.zeros(numIterations - start, dtype=numpy.int32)
+        try:
+            # For every game
+            for i in range(start, numIterations):
+                # Play game and record score
+                game = BitGame(rng=self._random)
+                gameStart = time.perf_counter()
+                scores[i - start] = self.play(verbose=False, game=game,
+                                              recorder=recorder,
+                                              profiler=profiler)
+                if logger is not None:
+                    logger.log(scores[i - start],
+                               2**int(game.state().max()), game.moves(),
+                               time.perf_counter() - gameStart)
+                if checkpointer is not None and checkpointer.due(i + 1):
+                    # The checkpoint records how far the log got
+                    if logger is not None:
+                        logger.flush()
+                    checkpointer.save(self, i + 1)
+        finally:
+            if ownLogger:
+                logger.close()
+            if checkpointer is not None:
+                checkpointer.wait()
+        return scores
+
+    def train_batched(self, num_games=1000, batch_size=100, logFile=None,
+                      _mode='w', rng=None, logger=None):
+        """Train agent over many games played batch_size at a time. Follows
+        the same steps as play, but for all games of the batch at once.
+        input:
+            num_games: Number of games to play
+            batch_size: Number of games played at the same time
+            logFile: logFile to stream a record of every game to (see
+                     telemetry). If None, doesn't record to a file
+            _mode: Mode to write to the logFile
+            rng: numpy.random.Generator or seed to reseed the agent with
+                 before training. If None keep drawing from the agent's.
+            logger: telemetry.GameLogger to stream the records to instead of
+                    logFile. It is not closed.
+        output:
+            final score of games in the order they finished"""
+        if rng is not None:
+            self.seed(rng)
+        # Initialize score array
+        scores = numpy.zeros(num_games, dtype=numpy.int32)
+        finished = 0
+        games = BatchGame(min(batch_size, num_games), num_games,
+                          self._random.generator)
+        # record previous states to update learning algorithm
+        prevStates = games.states()
+        # Moves and start time of the game on every board
+        moves = numpy.zeros(games.numBoards, dtype=numpy.int64)
+        startTimes = numpy.full(games.numBoards, time.perf_counter())
+        logger, ownLogger = self._openLogger(logFile, _mode, logger)
+        try:
+            while finished < num_games:
+                active = games.active()
+                # Choose next actions for the games in progress
+                actions = numpy.zeros(games.numBoards, dtype=numpy.int64)
+                actions[active] = self.chooseActions(
+                    games.states()[active], games.available_actions()[active])
+                # Perform actions, add random tiles and reset finished games
+                afterstates, rewards, done, finalScores = games.step(actions)
+                states = unpackBoards(afterstates)
+                # Update learning algorithm
+                self.learnBatch(prevStates[active], actions[active],
+                                states[active], rewards[active])
+                moves[active] += 1
+                # Record finished games
+                if logger is not None and numpy.any(done):
+                    now = time.perf_counter()
+                    logger.logRecords(makeRecords(
+                        finalScores[done],
+                        2**states[done].max(axis=(1, 2)), moves[done],
+                        now - startTimes[done]))
+                    startTimes[done] = now
+                moves[done] = 0
+                # Update prevStates. Restarted games begin from their new
+                # state.
+                prevStates = states
+                prevStates[done] = games.states()[done]
+                # Record final scores
+                numDone = numpy.count_nonzero(done)
+                scores[finished:finished + numDone] = finalScores[done]
+                finished += numDone
+        finally:
+            if ownLogger:
+                logger.close()
         return scores
 
+    def train_parallel(self, numIterations=1000, workers=None, logFile=None,
+                       _mode='w', rng=None, logger=None, **kwargs):
+        """Train agent over many games played by several processes at once.
+        The look up table is shared between the processes and updated
+        without locks. See parallel.trainParallel for further options.
+        input:
+            numIterations: Number of games to play
+            workers: Number of worker processes. If None use one per core.
+            logFile: logFile to stream a record of every game to (see
+                     telemetry), as the chunks of games finish. If None,
+                     doesn't record to a file
+            _mode: Mode to write to the logFile
+            rng: numpy.random.Generator or seed to reseed the agent with
+                 before training. The games of every chunk are seeded from
+                 it, so with one worker a run can be repeated exactly.
+            logger: telemetry.GameLogger to stream the records to instead of
+                    logFile. It is not closed.
+        output:
+            final score of games"""
+        if rng is not None:
+            self.seed(rng)
+        logger, ownLogger = self._openLogger(logFile, _mode, logger)
+        try:
+            return trainParallel(self, numIterations, workers, logger=logger,
+                                 **kwargs)
+        finally:
+            # The workers changed the table behind the agent's back
+            self.clearCache()
+            if ownLogger:
+                logger.close()
+
+    def train_offline(self, replays, passes=1, batch_size=64,
+                      chunk_size=2**16, shuffle=True, rng=None):
+        """Train agent from games recorded to replay files (see replay)
+        instead of playing new ones. Every move is learned from as in play,
+        but batch_size moves at a time with learnMinibatch.
+        input:
+            replays: Replay file, replay.ReplayReader or list of them
+            passes: Number of passes over all recorded moves
+            batch_size: Number of moves learned from at once. Their errors
+                        add up where they share tuple nums, so large
+                        batches may need a smaller learning rate.
+            chunk_size: Number of steps read from a replay file at a time
+            shuffle: If true visit the chunks of every pass in random order
+                     and shuffle the moves of every chunk
+            rng: numpy.random.Generator or seed to reseed the agent with
+                 before training. If None keep drawing from the agent's.
+        output:
+            number of moves learned from"""
+        if rng is not None:
+            self.seed(rng)
+        if not isinstance(replays, (list, tuple)):
+            replays = [replays]
+        readers = [replay if isinstance(replay, ReplayReader) else
+                   ReplayReader(replay) for replay in replays]
+        generator = self._random.generator
+        learned = 0
+        for _ in range(passes):
+            order = generator.permutation(len(readers)) if shuffle else \
+                range(len(readers))
+            for reader in (readers[i] for i in order):
+                for transitions in reader.transitions(
+                        chunk_size, generator if shuffle else None):
+                    if shuffle:
+                        transitions = transitions[generator.permutation(
+                            len(transitions))]
+                    # Learn from the moves of the chunk batch_size at a time
+                    for start in range(0, len(transitions), batch_size):
+                        batch = transitions[start:start + batch_size]
+                        self.learnMinibatch(unpackBoards(batch['prev_state']),
+                                        batch['action'].astype(numpy.int64),
+                                        unpackBoards(batch['afterstate']),
+                                        batch['reward'])
+                    learned += len(transitions)
+        return learned
+
+    def _openLogger(self, logFile, _mode, logger):
+        '''Return the logger training streams game records to and whether
+        training opened it (and has to close it)
+        input:
+            logFile: File to log to if logger is None. If None, doesn't log.
+            _mode: Mode to write to the logFile
+            logger: telemetry.GameLogger or None'''
+        if logger is None and logFile is not None:
+            return openLogger(logFile, _mode), True
+        return logger, False
+
     def makeGif(self, gif_file, num_trials=10, board_size=4, graphic_size=750,
-                top_margin=40, seperator_width=12, end_pause=50):
+                top_margin=40, seperator_width=12, end_pause=50, dedup=False):
         '''Construct gif of agent playing a game.
         input:
             gif_file: File to save gif
             num_trials: Number of games to look at and choose the best to make
-                        the gif
+                        the gif. The agent does not learn from them.
             board_size: Number of tiles in one side of board
             graphic_size: Size of graphic
             top_margin: Size of top margin
             seperator_width: Seperation between tiles in graphic
-            end_pause: How many frame to pause at end of gif'''
+            end_pause: How many frame to pause at end of gif
+            dedup: If true skip frames equal to the frame before'''
         # Play num_trials games and choose best for gif
         bestFinalScore = 0
         for i in range(num_trials):
-            finalScore, log = self.play(verbose=True) 
+            finalScore, log = self.play(verbose=True, learn=False)
             if finalScore > bestFinalScore:
                 bestFinalScore = finalScore
                 bestLog = log
         # Write to gif_file
-        with imageio.get_writer(gif_file, mode='I') as writer:
-            # For every game state
-            for i in range(numpy.shape(bestLog)[0]):
-                # Create image
-                img=makeImage(bestLog[i][0], bestLog[i][1], board_size,
-                              graphic_size,top_margin, seperator_width)
-                # Append to gif
-                writer.append_data(img)
-                # Pause on last frame
-                if i == numpy.shape(bestLog)[0]-1:
-                    for i in range(end_pause):
-                        writer.append_data(img)
+        from . import rendering
+        rendering.writeGif(gif_file, bestLog, board_size, graphic_size,
+                           top_margin, seperator_width, end_pause, dedup)
 
     def makeGraph(self, scores=[], logFile=None, graphFile=None, label=None, rollingWindow=30):
         '''Construct graph showing performance over training.
         input:
             scores: Scores to plot
             logFile: File to read scores in from. Will be append to provided
-                     scores.
+                     scores. Read in chunks, so it may be very large.
             graphFile: File to write graph to. Does not save graph if is None.
             label: Label for graph
             rollingWindow: Window for rolling average to smooth graph'''
-        # Append scores in logFile to scores
+        # Scores followed by the scores in logFile, chunk by chunk
+        chunks = [numpy.asarray(scores)]
         if logFile is not None:
-            with open(logFile, mode='r') as log_File:
-                reader = csv.reader(log_File, delimiter='\n')
-                for row in reader:
-                    scores.append(int(row[0]))
+            chunks = itertools.chain(chunks, (records['score'] for records
+                                              in readLog(logFile)))
         # Calculate rolling averages
-        rollingAverages = numpy.convolve(scores, numpy.ones((rollingWindow,))/rollingWindow, mode='valid')
+        rollingAverages = rollingAverage(chunks, rollingWindow)
         # Calculate values for x axis
         x = numpy.arange(len(rollingAverages))+rollingWindow/2
         # If label is none set label to tag
         if label is None:
             label=self.getTag()
         # Plot rollingAverages versus x
-        plt.plot(x, rollingAverages, label=label)
-        # Label axes
-        plt.xlabel('Trial')
-        plt.ylabel('Score')
-        # Save graph
-        if graphFile is not None:
-            plt.savefig(graphFile)
-            plt.clf()
+        from . import rendering
+        rendering.plotScores(x, rollingAverages, label, graphFile)
     
     def getTag(self):
         '''Return tag of agent'''
         return self.name + '_' + self.mask.getTag()
 
+    def _actionValues(self, tupleNums, action=None):
+        '''Add up the values of tupleNums in a look up table with one column
+        per action. Masks sharing weights between symmetric tuples store each
+        tuple's values under transformed actions (see Mask.getActionMap).
+        input:
+            tupleNums: Tuple nums of a state
+            action: Action to add up the values of. If None add up the values
+                    of every action.
+        output: Value of the state(action pair)'''
+        actionMap = self.mask.getActionMap()
+        if actionMap is None:
+            if action is None:
+                return self.tuples[tupleNums].sum(axis=0)
+            return self.tuples[tupleNums, action].sum()
+        if action is None:
+            return numpy.sum(self.tuples[tupleNums[:, None], actionMap], axis=0)
+        return numpy.sum(self.tuples[tupleNums, actionMap[:, action]])
+
+    def _batchActionValues(self, tupleNums):
+        '''Add up the values of every action for a batch of states (see
+        _actionValues)
+        input:
+            tupleNums: (N, numTuples) array of tuple nums
+        output: (N, 4) array of values'''
+        actionMap = self.mask.getActionMap()
+        if actionMap is None:
+            return self.tuples[tupleNums].sum(axis=1)
+        return self.tuples[tupleNums[..., None], actionMap].sum(axis=1)
+
+    def _batchTupleActions(self, tupleNums, actions):
+        '''Return (N, numTuples) array of the action each tuple num of a
+        batch stores the value of actions under (see _tupleActions)'''
+        actionMap = self.mask.getActionMap()
+        if actionMap is None:
+            return numpy.broadcast_to(numpy.asarray(actions)[:, None],
+                                      tupleNums.shape)
+        return actionMap[:, actions].T
+
+    def _updateTuples(self, tupleNums, errors, tupleActions=None):
+        '''Add the errors of a batch of transitions to the values of their
+        tuple nums and raise the updated values to at least zero. Tuple nums
+        shared by several transitions get the sum of their errors.
+        input:
+            tupleNums: (N, numTuples) array of tuple nums
+            errors: (N,) array of errors
+            tupleActions: (N, numTuples) array of the action each tuple num
+                          is updated under, for tables with one column per
+                          action'''
+        # numpy.add.at writes into read only tables, e.g. ones memory mapped
+        # by load(mmap=True), without checking
+        if isinstance(self.tuples, numpy.ndarray) and \
+                not self.tuples.flags.writeable:
+            raise ValueError('Look up table is read only, e.g. loaded with '
+                             'mmap=True')
+        deltas = numpy.broadcast_to(errors[:, None], tupleNums.shape)
+        if tupleActions is None:
+            self.mask.update(self.tuples, tupleNums, deltas)
+            if isinstance(self.tuples, Store):
+                self.tuples.clampMin(tupleNums)
+            else:
+                self.tuples[tupleNums] = numpy.maximum(self.tuples[tupleNums],
+                                                       0)
+        elif isinstance(self.tuples, Store):
+            # Stores update whole rows, so only the action's column is non
+            # zero
+            rowDeltas = numpy.zeros(tupleNums.shape + (4,))
+            numpy.put_along_axis(rowDeltas, tupleActions[..., None],
+                                 deltas[..., None], axis=-1)
+            self.mask.update(self.tuples, tupleNums, rowDeltas)
+            self.tuples.clampMin(tupleNums)
+        else:
+            numpy.add.at(self.tuples, (tupleNums, tupleActions), deltas)
+            self.tuples[tupleNums, tupleActions] = numpy.maximum(
+                self.tuples[tupleNums, tupleActions], 0)
+        # Values of cached states are out of date
+        self._cache.invalidate()
+
+    def getHyperparameters(self):
+        '''Return dictionary of the agent's hyperparameters'''
+        return {name: getattr(self, name) for name in
+                ('alpha', 'gamma', 'epsilon') if hasattr(self, name)}
+
     def save(self, fileName):
-        '''Save agent with pickle
+        '''Save the look up table of the agent. Dense tables are written raw
+        after a small header, see persistence.saveTable. Stores are pickled.
         input:
             fileName: Save file '''
-        pickleFile = open(fileName, 'wb')
-        pickle.dump(self.tuples, pickleFile)
-        pickleFile.close()
-
-    def load(self, fileName):
-        '''Load agent using pickle
+        if isinstance(self.tuples, Store):
+            with open(fileName, 'wb') as pickleFile:
+                pickle.dump(self.tuples, pickleFile)
+            return
+        saveTable(fileName, self.tuples, agent=self.name,
+                  agent_class=type(self).__name__, mask=self.mask.getTag(),
+                  hyperparameters=self.getHyperparameters())
+
+    def load(self, fileName, mmap=False):
+        '''Load the look up table of the agent. Files pickled by older
+        versions can still be loaded.
         input:
-            fileName: Save file'''
-        pickleFile = open(fileName, 'rb')
-        self.tuples = pickle.load(pickleFile)
-        pickleFile.close()
+            fileName: Save file
+            mmap: If true memory map the table read only instead of copying
+                  it into memory. Many processes can then share one copy of
+                  the table, but the agent can no longer learn.'''
+        header, tuples = loadTable(fileName, mmap)
+        if header is not None:
+            # Files written before the class was recorded only name the
+            # agent, which can be renamed
+            agentClass = header.get('agent_class')
+            if agentClass is not None and agentClass != type(self).__name__:
+                raise ValueError(fileName + ' was saved by a ' + agentClass +
+                                 ' but the agent is a ' +
+                                 type(self).__name__)
+            if header['mask'] != self.mask.getTag():
+                raise ValueError(fileName + ' was saved with mask ' +
+                                 header['mask'] + ' but the agent uses mask ' +
+                                 self.mask.getTag())
+        self._checkTable(fileName, tuples)
+        self.tuples = tuples
+        self.clearCache()
+
+    def _checkTable(self, fileName, tuples):
+        '''Raise ValueError if tuples does not have the shape of the agent's
+        look up table'''
+        if isinstance(tuples, Store):
+            if tuples.width != self._tableWidth:
+                raise ValueError(fileName + ' holds a store with width ' +
+                                 str(tuples.width) + ' but a ' +
+                                 type(self).__name__ + ' needs width ' +
+                                 str(self._tableWidth))
+            return
+        shape = (self.mask.getMaxTupleNum(),)
+        if self._tableWidth is not None:
+            shape += (self._tableWidth,)
+        if numpy.shape(tuples) != shape:
+            raise ValueError(fileName + ' holds a table of shape ' +
+                             str(numpy.shape(tuples)) + ' but a ' +
+                             type(self).__name__ + ' with mask ' +
+                             self.mask.getTag() + ' needs shape ' +
+                             str(shape))
+
+    def clearCache(self):
+        '''Forget the cached values of states. Call it after changing the
+        look up table other than through learn.'''
+        self._cache.invalidate()
 
 
 class QAgent(Agent):
     '''Class to perform q learning'''
 
-    def __init__(self, mask, a=0.025, g=0.9999, e=0.0001, name='q'):
+    # One value per action
+    _tableWidth = 4
+
+    def __init__(self, mask, a=0.025, g=0.9999, e=0.0001, name='q',
+                 dtype=float, store='dense', rng=None):
         '''Initialize the agent
         input:
             mask: Mask used to understand the game
             a: Learning rate
             g: Discount factor
             e: Exploration rate
-            name: Name of agent. Used in tag.'''
-        super().__init__(mask, name)
+            name: Name of agent. Used in tag.
+            dtype: dtype of the look up table, e.g. numpy.float32 to halve
+                   its memory
+            store: Kind of look up table, 'dense', 'hash' or 'hashed' (see
+                   stores.makeStore), or a Store instance
+            rng: numpy.random.Generator or seed of the agent'''
+        super().__init__(mask, name, rng)
         self.alpha = a
         self.gamma = g
         self.epsilon = e
         # Initialize q table
-        self.tuples = numpy.zeros((self.mask.getMaxTupleNum(), 4), dtype=float)
+        self.tuples = makeStore(store, self.mask.getMaxTupleNum(),
+                                self._tableWidth, dtype)
 
     def learn(self, prevState, action, state, reward): 
         '''Q Learning Algorithm
@@ -286,17 +700,40 @@ class QAgent(Agent):
             state: State after action is taken
             reward: Reward recieved from action'''
         # Get tupleNums of previous state
-        tupleNums = self.mask.getTupleNums(prevState)
+        tupleNums = self._cache.get(prevState)
+        prevValues = self._cache.getValue(prevState, self._actionValues)
         # Choose next action off policy 
-        next_action = randArgMax(numpy.sum([self.tuples[num] for num in tupleNums], axis=0))
+        next_action = randArgMax(prevValues, rng=self._random)
         # Calculate qError
         qError = self.alpha*(reward+self.gamma*self.lookUp(state,next_action)-self.lookUp(prevState,action))
-        # Update table entry for each tupleNum
-        for num in tupleNums:
-            self.tuples[num, action] += qError
-            if self.tuples[num, action] < 0:
-                self.tuples[num, action] = 0
-        
+        # Update table entry for each tupleNum at once
+        self._updateTuples(tupleNums[None], numpy.array([qError]),
+                           self._batchTupleActions(tupleNums[None], [action]))
+
+    def learnMinibatch(self, prevStates, actions, states, rewards):
+        '''Q Learning Algorithm for a batch of transitions. The errors of
+        all transitions are computed from the table as it is before the
+        batch and then added to it at once.
+        input:
+            prevStates: (N, 4, 4) array of states before actions are taken
+            actions: (N,) array of actions taken
+            states: (N, 4, 4) array of states after actions are taken
+            rewards: (N,) array of rewards recieved from actions'''
+        # Get tupleNums of previous states
+        tupleNums = self.mask.getTupleNums(prevStates)
+        tupleActions = self._batchTupleActions(tupleNums, actions)
+        # Choose next actions off policy, like learn does
+        nextActions = randArgMax(self._batchActionValues(tupleNums), axis=1,
+                                 rng=self._random)
+        nextValues = self._batchActionValues(self.mask.getTupleNums(states))
+        # Calculate qErrors
+        qErrors = self.alpha*(
+            rewards + self.gamma*nextValues[numpy.arange(len(nextActions)),
+                                            nextActions] -
+            self.tuples[tupleNums, tupleActions].sum(axis=1))
+        # Update table entries of every tupleNum
+        self._updateTuples(tupleNums, qErrors, tupleActions)
+
     def chooseAction(self, state, actions):
         '''Choose next action to take with q algorithm
         input:
@@ -304,30 +741,34 @@ class QAgent(Agent):
             actions: Possible actions to take
         output: Next action to take'''
         # Epsilon percent of the time take a random action
-        if (random.random() < self.epsilon):
-            return actions[random.randint(0, numpy.size(actions) - 1)]
+        if (self._random.random() < self.epsilon):
+            return actions[self._random.randrange(numpy.size(actions))]
         # Else Choose action that has highest value in lookup table
         values = self.lookUp(state)
-        for action in [0, 1, 2, 3]:
-            if not numpy.isin(action, actions):
-                values[action] = -1
-        return randArgMax(values)
+        unavailable = numpy.ones(4, dtype=bool)
+        unavailable[actions] = False
+        values[unavailable] = -1
+        return randArgMax(values, rng=self._random)
         
     def lookUp(self, state, action=None):
-         ''' Look up value of state(action pair) in look up table
+        ''' Look up value of state(action pair) in look up table
         input:
             state: State to look up
             action: Next action to take. If action is none look up the value
                     for each action.
         output: Value of state(action pair) in look up table'''
-        # Get tuple nums of state
-        tupleNums = self.mask.getTupleNums(state)
-        # If action is none get value for each action
+        # Masks sharing weights between symmetric tuples add up the values of
+        # a single action in another order than those of every action
+        if action is not None and self.mask.getActionMap() is not None:
+            return self._actionValues(self._cache.get(state), action)
+        # Add up the value for each tupleNum of state, once per state until
+        # the table changes
+        values = self._cache.getValue(state, self._actionValues)
+        # If action is none get value for each action. Copy them, callers
+        # may change them.
         if action is None:
-            return numpy.sum([self.tuples[num] for num in tupleNums], axis=0)
-        else:
-            # Add up the value for each tupleNum
-            return sum([self.tuples[num, action] for num in tupleNums])
+            return values.copy()
+        return values[action]
 
     def getTag(self):
         '''Return tag of agent'''
@@ -341,21 +782,31 @@ class QAgent(Agent):
 class SARSAAgent(Agent):
     '''Class to perform SARSA learning'''
 
-    def __init__(self, mask, a=0.01, g=0.75, e=0.001, name='SARSA'):
+    # One value per action
+    _tableWidth = 4
+
+    def __init__(self, mask, a=0.01, g=0.75, e=0.001, name='SARSA',
+                 dtype=float, store='dense', rng=None):
         '''Initialize the agent
         input:
             mask: Mask used to understand the game
             a: Learning rate
             g: Discount factor
             e: Exploration rate
-            name: Name of agent. Used in tag.'''
-
-        super().__init__(mask, name)
+            name: Name of agent. Used in tag.
+            dtype: dtype of the look up table, e.g. numpy.float32 to halve
+                   its memory
+            store: Kind of look up table, 'dense', 'hash' or 'hashed' (see
+                   stores.makeStore), or a Store instance
+            rng: numpy.random.Generator or seed of the agent'''
+
+        super().__init__(mask, name, rng)
         self.alpha = a
         self.gamma = g
         self.epsilon = e
         # Initialize table
-        self.tuples = numpy.zeros((self.mask.getMaxTupleNum(), 4), dtype=float)
+        self.tuples = makeStore(store, self.mask.getMaxTupleNum(),
+                                self._tableWidth, dtype)
 
     def learn(self, prevState, action, state, reward): 
         '''SARSA Learning Algorithm
@@ -365,17 +816,15 @@ class SARSAAgent(Agent):
             state: State after action is taken
             reward: Reward recieved from action'''
         # Get tupleNums of previous state
-        tupleNums = self.mask.getTupleNums(prevState)
+        tupleNums = self._cache.get(prevState)
         # Choose next action on policy
-        tempGame = Game(numpy.copy(state))
-        next_action = self.chooseAction(state, tempGame.available_actions())
+        next_action = self.chooseAction(
+            state, legal_action_list(legal_actions(pack(state))))
         # Calculate sarsaError
         sarsaError = self.alpha*(reward+self.gamma*self.lookUp(state,next_action)-self.lookUp(prevState,action))
-        # Update table entry for each tupleNum
-        for num in tupleNums:
-            self.tuples[num, action] += qError
-            if self.tuples[num, action] < 0:
-                self.tuples[num, action] = 0
+        # Update table entry for each tupleNum at once
+        self._updateTuples(tupleNums[None], numpy.array([sarsaError]),
+                           self._batchTupleActions(tupleNums[None], [action]))
         
     def chooseAction(self, state, actions):
         '''Choose next action to take with sarsa algorithm
@@ -384,14 +833,14 @@ class SARSAAgent(Agent):
             actions: Possible actions to take
         output: Next action to take'''
         # Epsilon percent of the time take a random action
-        if (random.random() < self.epsilon):
-            return actions[random.randint(0, numpy.size(actions) - 1)]
+        if (self._random.random() < self.epsilon):
+            return actions[self._random.randrange(numpy.size(actions))]
         # Else Choose action that has highest value in lookup table
         values = self.lookUp(state)
-        for action in [0, 1, 2, 3]:
-            if not numpy.isin(action, actions):
-                values[action] = -1
-        return randArgMax(values)
+        unavailable = numpy.ones(4, dtype=bool)
+        unavailable[actions] = False
+        values[unavailable] = -1
+        return randArgMax(values, rng=self._random)
         
     def lookUp(self, state, action=None):
         ''' Look up value of state(action pair) in look up table
@@ -400,14 +849,18 @@ class SARSAAgent(Agent):
             action: Next action to take. If action is none look up the value
                     for each action.
         output: Value of state(action pair) in look up table'''
-        # Get tuple nums of state
-        tupleNums = self.mask.getTupleNums(state)
-        # If action is none get value for each action
+        # Masks sharing weights between symmetric tuples add up the values of
+        # a single action in another order than those of every action
+        if action is not None and self.mask.getActionMap() is not None:
+            return self._actionValues(self._cache.get(state), action)
+        # Add up the value for each tupleNum of state, once per state until
+        # the table changes
+        values = self._cache.getValue(state, self._actionValues)
+        # If action is none get value for each action. Copy them, callers
+        # may change them.
         if action is None:
-            return numpy.sum([self.tuples[num] for num in tupleNums], axis=0)
-        else:
-            # Add up the value for each tupleNum
-            return sum([self.tuples[num, action] for num in tupleNums])
+            return values.copy()
+        return values[action]
 
     def getTag(self):
         '''Return tag of agent'''
@@ -421,20 +874,27 @@ class SARSAAgent(Agent):
 class TD0Agent(Agent):
     '''Class to perform TD0 learning'''
 
-    def __init__(self, mask, a=0.02, g=0.9999, e=0.0001, name='td0'):
+    def __init__(self, mask, a=0.02, g=0.9999, e=0.0001, name='td0',
+                 dtype=float, store='dense', rng=None):
         '''Initialize the agent
         input:
             mask: Mask used to understand the game
             a: Learning rate
             g: Discount factor
             e: Exploration rate
-            name: Name of agent. Used in tag.'''
-        super().__init__(mask, name)
+            name: Name of agent. Used in tag.
+            dtype: dtype of the look up table, e.g. numpy.float32 to halve
+                   its memory
+            store: Kind of look up table, 'dense', 'hash' or 'hashed' (see
+                   stores.makeStore), or a Store instance
+            rng: numpy.random.Generator or seed of the agent'''
+        super().__init__(mask, name, rng)
         self.alpha = a
         self.gamma = g
         self.epsilon = e
         #Initialize table
-        self.tuples = numpy.zeros(self.mask.getMaxTupleNum(), dtype=float)
+        self.tuples = makeStore(store, self.mask.getMaxTupleNum(),
+                                self._tableWidth, dtype)
 
     def learn(self, prevState, action, state, reward): 
         '''TD0 Learning Algorithm
@@ -444,14 +904,29 @@ class TD0Agent(Agent):
             state: State after action is taken
             reward: Reward recieved from action'''
         # Get tupleNums of previous state
-        tupleNums = self.mask.getTupleNums(prevState)
+        tupleNums = self._cache.get(prevState)
         # Calculate tdError
         tdError = self.alpha*(reward+self.gamma*self.lookUp(state)-self.lookUp(prevState))
-        # Update table entry for each tupleNum
-        for num in tupleNums:
-            self.tuples[num] += tdError
-            if self.tuples[num] < 0:
-                self.tuples[num] = 0
+        # Update table entry for each tupleNum at once
+        self._updateTuples(tupleNums[None], numpy.array([tdError]))
+
+    def learnMinibatch(self, prevStates, actions, states, rewards):
+        '''TD0 Learning Algorithm for a batch of transitions. The errors of
+        all transitions are computed from the table as it is before the
+        batch and then added to it at once.
+        input:
+            prevStates: (N, 4, 4) array of states before actions are taken
+            actions: (N,) array of actions taken
+            states: (N, 4, 4) array of states after actions are taken
+            rewards: (N,) array of rewards recieved from actions'''
+        # Get tupleNums of previous states
+        tupleNums = self.mask.getTupleNums(prevStates)
+        # Calculate tdErrors
+        tdErrors = self.alpha*(
+            rewards + self.gamma*self.mask.evaluate(self.tuples, states) -
+            self.tuples[tupleNums].sum(axis=1))
+        # Update table entries of every tupleNum
+        self._updateTuples(tupleNums, tdErrors)
 
     def chooseAction(self, state, actions):
         '''Choose next action to take with td0 algorithm
@@ -460,16 +935,42 @@ class TD0Agent(Agent):
             actions: Possible actions to take
         output: Next action to take'''
         # Epsilon percent of the time take a random action
-        if (random.random() < self.epsilon):
-            return actions[random.randint(0, numpy.size(actions) - 1)]
+        if (self._random.random() < self.epsilon):
+            return actions[self._random.randrange(numpy.size(actions))]
         # Else take action that puts you in state with highest value in look up
-        # table
-        values = numpy.full(4, -1, dtype=float)
-        for action in actions:
-            tempGame = Game(numpy.copy(state))
-            reward = tempGame.do_action(action)
-            values[action] = reward + self.lookUp(tempGame.state())
-        return randArgMax(values)
+        # table. Score all afterstates with one look up.
+        boards, rewards, _ = afterstates(pack(state))
+        states = unpackBoards(numpy.array(boards, dtype=numpy.uint64))
+        tupleNums = self.mask.getTupleNums(states)
+        stateValues = self.tuples[tupleNums].sum(axis=1)
+        values = numpy.add(rewards, stateValues)
+        unavailable = numpy.ones(4, dtype=bool)
+        unavailable[actions] = False
+        values[unavailable] = -1
+        action = randArgMax(values, rng=self._random)
+        # learn looks the chosen afterstate up again
+        self._cache.add(states[action], tupleNums[action],
+                        stateValues[action])
+        return action
+
+    def chooseActions(self, states, available):
+        '''Choose next action for a batch of games with td0 algorithm
+        input:
+            states: (N, 4, 4) array of current states
+            available: (N, 4) boolean array of available actions
+        output: (N,) array of next actions'''
+        # Score the afterstates of every game with one look up
+        results, rewards = moveBoards(packStates(states))
+        values = rewards + self.mask.evaluate(self.tuples,
+                                              unpackBoards(results))
+        values = numpy.where(available.T, values, -1).T
+        actions = randArgMax(values, axis=1, rng=self._random)
+        # Epsilon percent of the time take a random action
+        explore = self._random.randoms(len(actions)) < self.epsilon
+        if numpy.any(explore):
+            actions[explore] = randArgMax(available[explore], axis=1,
+                                          rng=self._random)
+        return actions
 
     def lookUp(self, state):
         ''' Look up value of state(action pair) in look up table
@@ -478,10 +979,13 @@ class TD0Agent(Agent):
             action: Next action to take. If action is none look up the value
                     for each action.
         output: Value of state(action pair) in look up table'''
-        # Get tuple nums of state
-        tupleNums = self.mask.getTupleNums(state)
-        # Add up the value for each tupleNum
-        return numpy.sum([self.tuples[num] for num in tupleNums])
+        # Add up the value for each tupleNum of state, once per state until
+        # the table changes
+        return self._cache.getValue(state, self._stateValue)
+
+    def _stateValue(self, tupleNums):
+        '''Add up the values of tupleNums in the look up table'''
+        return self.tuples[tupleNums].sum()
 
     def getTag(self):
         '''Return tag of agent'''
@@ -0,0 +1,187 @@
+"""Vectorized 2048 environment that steps many games at once.
+   Boards are kept as an (N,) array of packed 64 bit boards (see bitboard) and
+   moves, tile spawns, game over detection and rewards are computed for all
+   boards with numpy array operations."""
+
+import numpy
+from .bitboard import (ROW_MASK, ROW_LEFT_ARRAY, ROW_RIGHT_ARRAY,
+                       ROW_LEFT_REWARD_ARRAY, ROW_RIGHT_REWARD_ARRAY,
+                       transpose)
+from .game import ACTION_LEFT, ACTION_UP, ACTION_RIGHT, ACTION_DOWN
+from .rng import makeGenerator
+
+
+_SHIFTS = numpy.arange(60, -4, -4, dtype=numpy.uint64)
+_ROW_SHIFTS = numpy.array([48, 32, 16, 0], dtype=numpy.uint64)
+
+
+def unpackBoards(boards):
+    '''Unpack an (N,) array of packed boards into (N, 4, 4) states'''
+    boards = numpy.asarray(boards, dtype=numpy.uint64)
+    return ((boards[..., None] >> _SHIFTS) & numpy.uint64(0xF)).astype(
+        numpy.int64).reshape(boards.shape + (4, 4))
+
+
+def packStates(states):
+    '''Pack an (N, 4, 4) array of states into an (N,) array of boards'''
+    states = numpy.asarray(states, dtype=numpy.uint64)
+    flat = states.reshape(states.shape[:-2] + (16,))
+    return numpy.bitwise_or.reduce(flat << _SHIFTS, axis=-1)
+
+
+def moveBoards(boards):
+    '''Execute every action on every board
+    input:
+        boards: (N,) array of packed boards
+    output: Tuple of (4, N) array of resulting boards and (4, N) array of
+            rewards, indexed by action'''
+    boards = numpy.asarray(boards, dtype=numpy.uint64)
+    results = numpy.empty((4,) + boards.shape, dtype=numpy.uint64)
+    rewards = numpy.empty((4,) + boards.shape, dtype=numpy.int64)
+    # Rows of the board and of the transposed board (columns)
+    rows = (boards[..., None] >> _ROW_SHIFTS) & numpy.uint64(ROW_MASK)
+    cols = (transpose(boards)[..., None] >> _ROW_SHIFTS) & \
+        numpy.uint64(ROW_MASK)
+    for action, table, rewardTable, lines in (
+            (ACTION_LEFT, ROW_LEFT_ARRAY, ROW_LEFT_REWARD_ARRAY, rows),
+            (ACTION_RIGHT, ROW_RIGHT_ARRAY, ROW_RIGHT_REWARD_ARRAY, rows),
+            (ACTION_UP, ROW_LEFT_ARRAY, ROW_LEFT_REWARD_ARRAY, cols),
+            (ACTION_DOWN, ROW_RIGHT_ARRAY, ROW_RIGHT_REWARD_ARRAY, cols)):
+        moved = numpy.bitwise_or.reduce(table[lines] << _ROW_SHIFTS, axis=-1)
+        if lines is cols:
+            moved = transpose(moved)
+        results[action] = moved
+        rewards[action] = rewardTable[lines].sum(axis=-1)
+    return results, rewards
+
+
+class BatchGame(object):
+    '''Holds N games and steps all of them at once. Finished games are reset
+    automatically until numGames games have been started, after that their
+    boards are retired and ignored by later steps.'''
+
+    def __init__(self, numBoards, numGames=None, rng=None):
+        '''Init the BatchGame object.
+        input:
+            numBoards: Number of games played at the same time
+            numGames: Total number of games to play. If None finished games
+                      are always reset.
+            rng: numpy.random.Generator or seed the random tiles are drawn
+                 from'''
+        self.numBoards = numBoards
+        self._rng = makeGenerator(rng)
+        self._boards = numpy.zeros(numBoards, dtype=numpy.uint64)
+        self._scores = numpy.zeros(numBoards, dtype=numpy.int64)
+        self._active = numpy.zeros(numBoards, dtype=bool)
+        if numGames is None:
+            self._gamesLeft = None
+        else:
+            self._gamesLeft = numGames
+        self._reset(numpy.ones(numBoards, dtype=bool))
+
+    def _reset(self, which):
+        '''Start new games on the boards selected by the boolean array which.
+        Boards that are not started because there are no games left are
+        retired.'''
+        which = numpy.array(which, dtype=bool)
+        if self._gamesLeft is not None:
+            # Retire boards beyond the number of games left to play
+            indices = numpy.flatnonzero(which)
+            which[indices[self._gamesLeft:]] = False
+            self._active[indices[self._gamesLeft:]] = False
+            self._gamesLeft -= min(self._gamesLeft, len(indices))
+        self._boards[which] = 0
+        self._scores[which] = 0
+        self._active[which] = True
+        self.add_random_tiles(which)
+        self.add_random_tiles(which)
+
+    def add_random_tiles(self, which=None):
+        '''Adds a random tile to every selected board. Assumes that they have
+        empty fields.
+        input:
+            which: Boolean array selecting boards. If None all active boards.'''
+        if which is None:
+            which = self._active
+        boards = self._boards[which]
+        empty = ((boards[:, None] >> _SHIFTS) & numpy.uint64(0xF)) == 0
+        numEmpty = empty.sum(axis=1)
+        assert numpy.all(numEmpty != 0)
+        # Draw the field and the value of every board at once
+        draws = self._rng.random((2, len(boards)))
+        # Pick the k-th empty field of each board
+        k = (draws[0] * numEmpty).astype(numpy.int64)
+        position = numpy.argmax(numpy.cumsum(empty, axis=1) > k[:, None],
+                                axis=1)
+        value = numpy.where(draws[1] < 0.9, 1, 2)
+        self._boards[which] = boards | (value.astype(numpy.uint64) <<
+                                        _SHIFTS[position])
+
+    def afterstates(self):
+        '''Execute every action on a copy of every board.
+        output: Tuple of (4, N) arrays of resulting boards, rewards and
+                whether each action is available, indexed by action'''
+        results, rewards = moveBoards(self._boards)
+        return results, rewards, results != self._boards
+
+    def available_actions(self):
+        '''Computes the available actions of every board.
+        output: (N, 4) boolean array'''
+        results, _ = moveBoards(self._boards)
+        return (results != self._boards).T
+
+    def game_over(self):
+        '''Return (N,) boolean array which is true where the game is over'''
+        return ~numpy.any(self.available_actions(), axis=1)
+
+    def do_actions(self, actions):
+        '''Execute one action on every active board, update the scores and
+        return the rewards. Retired boards are left unchanged.
+        input:
+            actions: (N,) array of actions
+        output: (N,) array of rewards'''
+        actions = numpy.asarray(actions, dtype=numpy.int64)
+        results, rewards = moveBoards(self._boards)
+        index = numpy.arange(self.numBoards)
+        reward = numpy.where(self._active, rewards[actions, index], 0)
+        self._boards = numpy.where(self._active, results[actions, index],
+                                   self._boards)
+        self._scores += reward
+        return reward
+
+    def step(self, actions):
+        '''Execute actions, add random tiles and reset finished games.
+        Boards whose action is not available are left unchanged.
+        input:
+            actions: (N,) array of actions
+        output: Tuple of (N,) array of packed boards right after the actions
+                (before the random tiles), (N,) array of rewards, (N,) boolean
+                array marking games that finished this step and (N,) array
+                holding the final score of those games'''
+        before = self._boards
+        rewards = self.do_actions(actions)
+        afterstates = self._boards.copy()
+        # Like in the game, actions that change nothing add no tile
+        self.add_random_tiles(self._active & (afterstates != before))
+        done = self.game_over() & self._active
+        finalScores = numpy.where(done, self._scores, 0)
+        if numpy.any(done):
+            self._reset(done)
+        return afterstates, rewards, done, finalScores
+
+    def boards(self):
+        '''Return (N,) array of packed boards'''
+        return self._boards
+
+    def states(self):
+        '''Return (N, 4, 4) array of states'''
+        return unpackBoards(self._boards)
+
+    def scores(self):
+        '''Return (N,) array of current scores'''
+        return self._scores
+
+    def active(self):
+        '''Return (N,) boolean array marking boards with a game in progress.
+        It is a copy, step changes the marks when boards retire.'''
+        return self._active.copy()
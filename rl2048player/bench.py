@@ -0,0 +1,291 @@
+'''Benchmarks for the hot paths of the game engines, masks and agents.
+   Run with python -m rl2048player.bench --help. Every benchmark seeds its
+   random generators, warms up and reports the best of several repeats as
+   operations per second, so results can be compared against a stored
+   baseline file.'''
+import argparse
+import json
+import numpy
+import platform
+import subprocess
+import sys
+import time
+from .agents import QAgent, SARSAAgent, TD0Agent
+from .batch import BatchGame
+from .bitboard import BitGame
+from .game import Game
+from .masks import Mask_rxcx4, NTupleMask
+from .profiling import PlayProfiler
+from .rng import RandomBuffer
+from .stores import makeStore, measureThroughput
+
+
+def _opsPerSec(func, items, repeat=3, warmup=1):
+    '''Measure how often func can be called per second
+    input:
+        func: Function taking one item
+        items: Items to call func with, once each per repeat
+        repeat: Number of timed repeats, the fastest counts
+        warmup: Number of untimed repeats before timing
+    output: Calls per second'''
+    for _ in range(warmup):
+        for item in items:
+            func(item)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return len(items)/max(best, 1e-12)
+
+
+def _randomStates(number, seed):
+    '''Return states seen while playing random games'''
+    random = RandomBuffer(seed)
+    states = []
+    while len(states) < number:
+        game = BitGame(rng=random)
+        while not game.game_over() and len(states) < number:
+            states.append(game.state().copy())
+            actions = game.available_actions()
+            game.do_action(actions[random.randrange(len(actions))])
+            game.add_random_tile()
+    return states
+
+
+def _randomTransitions(number, seed):
+    '''Return (prevState, action, state, reward) transitions of random games,
+    in the order play would learn them'''
+    random = RandomBuffer(seed)
+    transitions = []
+    while len(transitions) < number:
+        game = BitGame(rng=random)
+        prevState = game.state().copy()
+        while not game.game_over() and len(transitions) < number:
+            actions = game.available_actions()
+            action = actions[random.randrange(len(actions))]
+            reward = game.do_action(action)
+            transitions.append((prevState, action, game.state().copy(),
+                                reward))
+            prevState = game.state().copy()
+            game.add_random_tile()
+    return transitions
+
+
+def benchEngine(seed=0, quick=False):
+    '''Benchmark do_action, is_action_available and legal_actions of both
+    game engines and the steps of BatchGame'''
+    number = 200 if quick else 2000
+    states = _randomStates(number, seed)
+    results = {}
+    for name, gameClass in (('game', Game), ('bitgame', BitGame)):
+        games = [(gameClass(state.copy()), action) for state in states
+                 for action in range(4)]
+        # Copies do not remember the legal actions of their board
+        results[name + '.is_action_available'] = _opsPerSec(
+            lambda item: item[0].copy().is_action_available(item[1]), games)
+        results[name + '.do_action'] = _opsPerSec(
+            lambda item: item[0].copy().do_action(item[1]), games)
+        results[name + '.legal_actions'] = _opsPerSec(
+            lambda item: item.copy().legal_actions(),
+            [gameClass(state.copy()) for state in states])
+    batch = BatchGame(256, rng=seed)
+    actions = numpy.random.default_rng(seed).integers(
+        0, 4, (20 if quick else 100, 256))
+    results['batchgame.step'] = 256*_opsPerSec(batch.step, actions)
+    return results
+
+
+def _masks():
+    '''Return the masks to benchmark by name'''
+    return {'rxcx4': Mask_rxcx4(), 'rxcx4c': Mask_rxcx4(compact=True),
+            'rxcx4s': Mask_rxcx4(symmetric=True), 'nt4x6s': NTupleMask('4x6')}
+
+
+def benchMasks(seed=0, quick=False):
+    '''Benchmark getTupleNums for single states and batches of states'''
+    states = _randomStates(200 if quick else 2000, seed)
+    batch = numpy.array(states)
+    results = {}
+    for name, mask in _masks().items():
+        results[name + '.getTupleNums'] = _opsPerSec(mask.getTupleNums,
+                                                     states)
+        results[name + '.getTupleNums_batch'] = len(batch)*_opsPerSec(
+            mask.getTupleNums, [batch])
+    return results
+
+
+def benchAgents(seed=0, quick=False):
+    '''Benchmark lookUp, learn and chooseAction of every agent'''
+    transitions = _randomTransitions(100 if quick else 1000, seed)
+    mask = Mask_rxcx4(compact=True)
+    results = {}
+    for agentClass in (QAgent, SARSAAgent, TD0Agent):
+        agent = agentClass(mask, rng=seed)
+        name = agent.name.lower()
+        results[name + '.lookUp'] = _opsPerSec(
+            lambda item: agent.lookUp(item[2]), transitions)
+        results[name + '.learn'] = _opsPerSec(
+            lambda item: agent.learn(*item), transitions, repeat=1)
+        results[name + '.chooseAction'] = _opsPerSec(
+            lambda item: agent.chooseAction(item[2], [0, 1, 2, 3]),
+            transitions)
+    return results
+
+
+def benchStores(seed=0, quick=False):
+    '''Benchmark look ups and updates of every kind of weight store'''
+    mask = Mask_rxcx4(compact=True)
+    results = {}
+    for kind in ('dense', 'hash', 'hashed'):
+        store = makeStore(kind, mask.getMaxTupleNum())
+        measured = measureThroughput(store, mask, 200 if quick else 2000,
+                                     seed=seed)
+        results[kind + '.lookups'] = measured['lookups_per_sec']
+        results[kind + '.updates'] = measured['updates_per_sec']
+    return results
+
+
+def benchTraining(seed=0, quick=False):
+    '''Benchmark games per second of train and train_batched'''
+    numGames = 2 if quick else 20
+    mask = Mask_rxcx4(compact=True)
+    results = {}
+    for agentClass in (QAgent, SARSAAgent, TD0Agent):
+        agent = agentClass(mask, rng=seed)
+        results[agent.name.lower() + '.train'] = _opsPerSec(
+            agent.train, [numGames], repeat=1, warmup=0)*numGames
+    agent = TD0Agent(mask, rng=seed)
+    results['td0.train_batched'] = _opsPerSec(
+        lambda num: agent.train_batched(num, num), [4*numGames], repeat=1,
+        warmup=0)*4*numGames
+    return results
+
+
+def benchProfiling(seed=0, quick=False):
+    '''Benchmark games per second of play without a profiler, with one
+    counting every phase and with one running cProfile for every game. The
+    first and the training benchmark of td0 show the cost of the profiling
+    hooks when they are off.'''
+    numGames = 2 if quick else 10
+    mask = Mask_rxcx4(compact=True)
+    results = {}
+    for name, makeProfiler in (('play', lambda: None),
+                               ('play_counters', PlayProfiler),
+                               ('play_cprofile',
+                                lambda: PlayProfiler(profileEvery=1))):
+        # Every variant plays the same games
+        agent = TD0Agent(mask, rng=seed)
+        profiler = makeProfiler()
+        results['td0.' + name] = numGames*_opsPerSec(
+            lambda num: [agent.play(learn=False, profiler=profiler)
+                         for _ in range(num)], [numGames], warmup=0)
+    return results
+
+
+def benchImports(seed=0, quick=False):
+    '''Benchmark how often a fresh interpreter can start and import the
+    package per second. Importing only numpy is the upper bound.'''
+    repeat = 3 if quick else 10
+    results = {}
+    for name, module in (('numpy', 'numpy'), ('rl2048player', 'rl2048player')):
+        command = [sys.executable, '-c', 'import ' + module]
+        results['import.' + name] = _opsPerSec(
+            lambda item: subprocess.run(command, check=True), [None],
+            repeat=repeat)
+    return results
+
+
+BENCHMARKS = {'engine': benchEngine, 'masks': benchMasks,
+              'agents': benchAgents, 'stores': benchStores,
+              'training': benchTraining, 'profiling': benchProfiling,
+              'imports': benchImports}
+
+
+def runBenchmarks(names=None, seed=0, quick=False):
+    '''Run benchmarks
+    input:
+        names: Names of benchmarks in BENCHMARKS to run. If None run all.
+        seed: Seed for the random generators
+        quick: If true use fewer iterations
+    output: Dictionary with the environment and, for every benchmark, a
+            dictionary of operations per second'''
+    if names is None:
+        names = list(BENCHMARKS)
+    results = {'environment': {'python': platform.python_version(),
+                               'numpy': numpy.__version__,
+                               'platform': platform.platform(),
+                               'seed': seed, 'quick': quick}}
+    for name in names:
+        results[name] = BENCHMARKS[name](seed, quick)
+    return results
+
+
+def compareResults(results, baseline, tolerance=0.1):
+    '''Compare results against a baseline
+    input:
+        results: Results of runBenchmarks
+        baseline: Results of an earlier runBenchmarks
+        tolerance: Fraction a measurement may be slower than the baseline
+                   before it counts as a regression
+    output: List of (benchmark, measurement, value, baseline value, ratio,
+            regressed) for every measurement in both'''
+    comparison = []
+    for name, measurements in results.items():
+        if name == 'environment' or name not in baseline:
+            continue
+        for key, value in measurements.items():
+            if key not in baseline[name]:
+                continue
+            ratio = value/max(baseline[name][key], 1e-12)
+            comparison.append((name, key, value, baseline[name][key], ratio,
+                               ratio < 1 - tolerance))
+    return comparison
+
+
+def main(argv=None):
+    '''Command line interface'''
+    parser = argparse.ArgumentParser(
+        prog='python -m rl2048player.bench',
+        description='Benchmark the hot paths of rl2048player.')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run, any of ' +
+                        ', '.join(BENCHMARKS) + ' (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true',
+                        help='Use fewer iterations')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='Compare results against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark ' + name)
+    results = runBenchmarks(args.benchmarks or None, args.seed, args.quick)
+    if args.output is not None:
+        with open(args.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2, sort_keys=True)
+    regressed = False
+    if args.baseline is not None:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        for name, key, value, base, ratio, slower in compareResults(
+                results, baseline, args.tolerance):
+            regressed |= slower
+            print('{:<40} {:>14.1f} {:>14.1f} {:>7.2f}x{}'.format(
+                name + '/' + key, value, base, ratio,
+                '  REGRESSION' if slower else ''))
+    else:
+        for name, measurements in results.items():
+            if name == 'environment':
+                continue
+            for key, value in measurements.items():
+                print('{:<40} {:>14.1f}/s'.format(name + '/' + key, value))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""Bitboard implementation of the 2048 game logic.
+   The board is packed into a single 64 bit integer with one 4 bit nibble per
+   field. Row 0 occupies the 16 most significant bits and inside of a row
+   column 0 is the most significant nibble, so the hex representation of a
+   board reads the fields in row major order. Every one of the 65536 possible
+   rows is moved once at import time and the results are stored in look up
+   tables, so executing an action only takes a handful of table look ups."""
+
+import numpy
+from .game import (ACTION_LEFT, ACTION_UP, ACTION_RIGHT, ACTION_DOWN,
+                   legal_action_list)
+from .rng import makeRandom
+
+
+ROW_MASK = 0xFFFF
+# Largest tile that fits into a nibble. Merging two of them saturates.
+MAX_TILE = 15
+
+
+def _move_rows_left(tiles):
+    """Moves many rows to the left at once. Tiles slide left over empty
+    fields, and two equal neighbours merge into one tile of the next value,
+    which is added to the reward. A merged tile does not merge again in the
+    same move, and merges saturate at MAX_TILE. These are the rules of
+    Game._do_action_left.
+    input: (N, 4) array of ln2 values
+    output: Tuple of (N, 4) array of moved rows and (N,) array of rewards"""
+    index = numpy.arange(len(tiles))
+    # Slide the tiles together, keeping their order, and pad with zeros so
+    # reading past the last tile is safe. Empty fields go to column 10.
+    padded = numpy.zeros((len(tiles), 11), dtype=numpy.int64)
+    count = numpy.zeros(len(tiles), dtype=numpy.int64)
+    for col in range(4):
+        filled = tiles[:, col] != 0
+        padded[index, numpy.where(filled, count, 10)] = tiles[:, col]
+        count += filled
+    moved = numpy.zeros((len(tiles), 4), dtype=numpy.int64)
+    reward = numpy.zeros(len(tiles), dtype=numpy.int64)
+    # Position of the next tile to place in each row
+    position = numpy.zeros(len(tiles), dtype=numpy.int64)
+    for col in range(4):
+        tile = padded[index, position]
+        merge = (tile != 0) & (tile == padded[index, position + 1])
+        moved[:, col] = numpy.where(merge, numpy.minimum(tile + 1, MAX_TILE),
+                                    tile)
+        reward += numpy.where(merge, 2 ** moved[:, col], 0)
+        position += numpy.where(merge, 2, 1)
+    return moved, reward
+
+
+def _build_tables():
+    """Build the row look up tables with numpy, which keeps importing the
+    module fast.
+    output: Tuple of left results, right results, left rewards and right
+            rewards arrays indexed by the 16 bit row"""
+    rows = numpy.arange(ROW_MASK + 1, dtype=numpy.int64)
+    shifts = numpy.array([12, 8, 4, 0])
+    tiles = (rows[:, None] >> shifts) & 0xF
+    moved, left_reward = _move_rows_left(tiles)
+    left = numpy.bitwise_or.reduce(moved << shifts, axis=1)
+    # Moving right is moving the reversed row left
+    reverse = numpy.bitwise_or.reduce(tiles << shifts[::-1], axis=1)
+    right = numpy.bitwise_or.reduce(
+        ((left[reverse][:, None] >> shifts) & 0xF) << shifts[::-1], axis=1)
+    right_reward = left_reward[reverse]
+    return left, right, left_reward, right_reward
+
+
+def _build_empty():
+    """Build the table of empty fields of every row. There are only 16
+    patterns of empty fields, so every row gets one of 16 shared tuples."""
+    patterns = [tuple(col for col in range(4) if (pattern >> (3 - col)) & 1)
+                for pattern in range(16)]
+    rows = numpy.arange(ROW_MASK + 1)
+    empty = numpy.zeros(ROW_MASK + 1, dtype=numpy.int64)
+    for col in range(4):
+        empty |= (((rows >> (12 - 4 * col)) & 0xF) == 0) << (3 - col)
+    return [patterns[pattern] for pattern in empty.tolist()]
+
+
+def _build_legal(left, right):
+    """Build the tables of the actions that change each row. A row is a row
+    of the board for left and right and a column of it for up and down.
+    output: Tuple of legal action bitmasks of each row as a row and as a
+            column"""
+    rows = numpy.arange(ROW_MASK + 1, dtype=left.dtype)
+    changes_left = (left != rows).astype(numpy.int64)
+    changes_right = (right != rows).astype(numpy.int64)
+    as_row = (changes_left << ACTION_LEFT) | (changes_right << ACTION_RIGHT)
+    as_col = (changes_left << ACTION_UP) | (changes_right << ACTION_DOWN)
+    return as_row.tolist(), as_col.tolist()
+
+
+# Numpy tables for moving many boards at once
+(ROW_LEFT_ARRAY, ROW_RIGHT_ARRAY, ROW_LEFT_REWARD_ARRAY,
+ ROW_RIGHT_REWARD_ARRAY) = _build_tables()
+ROW_LEFT_ARRAY = ROW_LEFT_ARRAY.astype(numpy.uint64)
+ROW_RIGHT_ARRAY = ROW_RIGHT_ARRAY.astype(numpy.uint64)
+# List copies of the tables, indexing a list with an int is faster
+ROW_LEFT = ROW_LEFT_ARRAY.tolist()
+ROW_RIGHT = ROW_RIGHT_ARRAY.tolist()
+ROW_LEFT_REWARD = ROW_LEFT_REWARD_ARRAY.tolist()
+ROW_RIGHT_REWARD = ROW_RIGHT_REWARD_ARRAY.tolist()
+# Positions (0 is the leftmost column) of the empty fields in each row
+ROW_EMPTY = _build_empty()
+# Legal action bitmask of each row, as a row and as a column of a board
+ROW_LEGAL, COL_LEGAL = _build_legal(ROW_LEFT_ARRAY, ROW_RIGHT_ARRAY)
+_SHIFTS = numpy.arange(60, -4, -4, dtype=numpy.uint64)
+
+
+def transpose(board):
+    """Transpose a packed board (swap rows and columns) with bit tricks."""
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def pack(state):
+    """Pack a (4, 4) state array of ln2 values into a 64 bit integer."""
+    return int(numpy.bitwise_or.reduce(
+        numpy.asarray(state, dtype=numpy.uint64).reshape(16) << _SHIFTS))
+
+
+def unpack(board):
+    """Unpack a 64 bit integer into a (4, 4) state array of ln2 values."""
+    return ((numpy.uint64(board) >> _SHIFTS) & numpy.uint64(0xF)).astype(
+        numpy.int64).reshape(4, 4)
+
+
+def changedCells(board, other):
+    """Find the cells in which two packed boards differ.
+    input:
+        board: Packed board
+        other: Packed board
+    output: Tuple of lists of the flat indices (row*4 + col) of the cells,
+            their values on board and their values on other"""
+    diff = board ^ other
+    cells = []
+    values = []
+    otherValues = []
+    for row in range(4):
+        # Skip rows the boards agree on
+        if not (diff >> (48 - 16 * row)) & ROW_MASK:
+            continue
+        for col in range(4):
+            shift = 60 - 16 * row - 4 * col
+            if (diff >> shift) & 0xF:
+                cells.append(4 * row + col)
+                values.append((board >> shift) & 0xF)
+                otherValues.append((other >> shift) & 0xF)
+    return cells, values, otherValues
+
+
+def countChangedCells(board, other):
+    """Count the cells in which two packed boards differ."""
+    diff = board ^ other
+    # Fold every cell onto its lowest bit
+    diff = (diff | (diff >> 1) | (diff >> 2) | (diff >> 3)) & 0x1111111111111111
+    return bin(diff).count('1')
+
+
+def _move_rows(board, table):
+    """Apply a row table to each of the four rows of a board."""
+    return ((table[(board >> 48) & ROW_MASK] << 48) |
+            (table[(board >> 32) & ROW_MASK] << 32) |
+            (table[(board >> 16) & ROW_MASK] << 16) |
+            table[board & ROW_MASK])
+
+
+def _reward_rows(board, table):
+    """Sum a row reward table over the four rows of a board."""
+    return (table[(board >> 48) & ROW_MASK] +
+            table[(board >> 32) & ROW_MASK] +
+            table[(board >> 16) & ROW_MASK] +
+            table[board & ROW_MASK])
+
+
+def move(board, action):
+    """Execute action on a packed board.
+    input:
+        board: Packed board
+        action: Action to execute
+    output: Tuple of resulting packed board and reward"""
+    if action == ACTION_LEFT:
+        return (_move_rows(board, ROW_LEFT),
+                _reward_rows(board, ROW_LEFT_REWARD))
+    if action == ACTION_RIGHT:
+        return (_move_rows(board, ROW_RIGHT),
+                _reward_rows(board, ROW_RIGHT_REWARD))
+    # Up and down are left and right on the transposed board
+    board = transpose(board)
+    if action == ACTION_UP:
+        return (transpose(_move_rows(board, ROW_LEFT)),
+                _reward_rows(board, ROW_LEFT_REWARD))
+    if action == ACTION_DOWN:
+        return (transpose(_move_rows(board, ROW_RIGHT)),
+                _reward_rows(board, ROW_RIGHT_REWARD))
+    raise ValueError('Unknown action: ' + str(action))
+
+
+def legal_actions(board):
+    """Compute the bitmask of the actions that change a packed board, bit
+    action being set if action is available. Zero if the game is over."""
+    transposed = transpose(board)
+    return (ROW_LEGAL[(board >> 48) & ROW_MASK] |
+            ROW_LEGAL[(board >> 32) & ROW_MASK] |
+            ROW_LEGAL[(board >> 16) & ROW_MASK] |
+            ROW_LEGAL[board & ROW_MASK] |
+            COL_LEGAL[(transposed >> 48) & ROW_MASK] |
+            COL_LEGAL[(transposed >> 32) & ROW_MASK] |
+            COL_LEGAL[(transposed >> 16) & ROW_MASK] |
+            COL_LEGAL[transposed & ROW_MASK])
+
+
+def afterstates(board):
+    """Execute every action on a packed board.
+    input:
+        board: Packed board
+    output: Tuple of the resulting packed boards, the rewards and whether
+            each action is available (changes the board), each a tuple
+            indexed by action"""
+    transposed = transpose(board)
+    boards = [0] * 4
+    rewards = [0] * 4
+    boards[ACTION_LEFT] = _move_rows(board, ROW_LEFT)
+    rewards[ACTION_LEFT] = _reward_rows(board, ROW_LEFT_REWARD)
+    boards[ACTION_RIGHT] = _move_rows(board, ROW_RIGHT)
+    rewards[ACTION_RIGHT] = _reward_rows(board, ROW_RIGHT_REWARD)
+    boards[ACTION_UP] = transpose(_move_rows(transposed, ROW_LEFT))
+    rewards[ACTION_UP] = _reward_rows(transposed, ROW_LEFT_REWARD)
+    boards[ACTION_DOWN] = transpose(_move_rows(transposed, ROW_RIGHT))
+    rewards[ACTION_DOWN] = _reward_rows(transposed, ROW_RIGHT_REWARD)
+    return (tuple(boards), tuple(rewards),
+            tuple(result != board for result in boards))
+
+
+class BitGame(object):
+    """Drop in replacement for game.Game that stores the board as a 64 bit
+    integer. Implements the same interface, so agents can use either one.
+    state() still returns a (4, 4) numpy array of ln2 values."""
+
+    def __init__(self, state=None, initial_score=0, boardSize=4, rng=None):
+        """Init the BitGame object.
+        Args:
+          state: Shape (4, 4) numpy array or packed board to initialize the
+              state with. If None the state will be initialized with two
+              random tiles (as done in the original game).
+          initial_score: Score to initialize the Game with.
+          boardSize: Only boards of size 4 X 4 can be packed
+          rng: numpy.random.Generator, seed or rng.RandomBuffer the random
+              tiles are drawn from. Copies of the game share it."""
+        if boardSize != 4:
+            raise ValueError('BitGame only supports boardSize 4')
+        self._score = initial_score
+        self._moves = 0
+        self.boardSize = boardSize
+        self._random = makeRandom(rng)
+        # Cache of the unpacked state and of its legal actions
+        self._state = None
+        self._legal = None
+        if state is None:
+            self._board = 0
+            self.add_random_tile()
+            self.add_random_tile()
+        elif isinstance(state, (int, numpy.integer)):
+            self._board = int(state)
+        else:
+            self._board = pack(state)
+
+    def copy(self):
+        """Return a copy of self."""
+        game = BitGame(self._board, self._score, rng=self._random)
+        game._moves = self._moves
+        return game
+
+    def game_over(self):
+        """Return true if game is over"""
+        return self.legal_actions() == 0
+
+    def available_actions(self):
+        """Computes the set of actions that are available."""
+        return legal_action_list(self.legal_actions())
+
+    def legal_actions(self):
+        """Return the bitmask of the available actions, bit action being set
+        if action is available. Computed once per board."""
+        if self._legal is None:
+            self._legal = legal_actions(self._board)
+        return self._legal
+
+    def is_action_available(self, action):
+        """Determines whether action is available.
+        That is, executing it would change the state."""
+        return (self.legal_actions() >> action) & 1 == 1
+
+    def do_action(self, action):
+        """Execute action, update the score, and return the reward."""
+        self._board, reward = move(self._board, action)
+        self._state = None
+        self._legal = None
+        self._score += reward
+        self._moves += 1
+        return reward
+
+    def afterstates(self):
+        """Execute every action on a copy of the board.
+        output: Tuple of the resulting packed boards, the rewards and whether
+                each action is available, each a tuple indexed by action"""
+        return afterstates(self._board)
+
+    def add_random_tile(self):
+        """Adds a random tile to the grid. Assumes that it has empty fields."""
+        board = self._board
+        empty = [(row, col) for row in range(4)
+                 for col in ROW_EMPTY[(board >> (48 - 16 * row)) & ROW_MASK]]
+        assert len(empty) != 0
+        row, col = empty[self._random.randrange(len(empty))]
+        value = 1 if self._random.random() < 0.9 else 2
+        self._board = board | (value << (60 - 16 * row - 4 * col))
+        self._state = None
+        self._legal = None
+
+    def board(self):
+        """Return current packed board."""
+        return self._board
+
+    def state(self):
+        """Return current state."""
+        if self._state is None:
+            self._state = unpack(self._board)
+        return self._state
+
+    def score(self):
+        """Return current score."""
+        return self._score
+
+    def moves(self):
+        """Return number of actions executed so far."""
+        return self._moves
@@ -0,0 +1,121 @@
+'''Code relating to checkpointing training runs. A checkpoint holds the look
+up table together with everything needed to continue the run exactly: the
+state of the agent's random numbers, the number of games played and the size
+of the log file at that point. Taking a checkpoint only copies the table, the
+copy is written to disk by a background thread while training goes on.'''
+import copy
+import os
+import pickle
+import threading
+from .persistence import saveTable, loadTable, readHeader
+from .stores import Store
+
+
+# Name of the checkpoint file inside the checkpoint directory
+CHECKPOINT_FILE = 'checkpoint.table'
+
+
+def checkpointFile(directory):
+    '''Return the checkpoint file of a checkpoint directory'''
+    return os.path.join(directory, CHECKPOINT_FILE)
+
+
+def writeCheckpoint(fileName, tuples, state):
+    '''Write a checkpoint. Like persistence.saveTable the file is replaced
+    atomically, so a crash leaves the previous checkpoint intact.
+    input:
+        fileName: Checkpoint file
+        tuples: Look up table (numpy array or Store)
+        state: JSON serializable dictionary describing the run'''
+    if isinstance(tuples, Store):
+        tempName = fileName + '.tmp'
+        with open(tempName, 'wb') as pickleFile:
+            pickle.dump({'checkpoint': state, 'tuples': tuples}, pickleFile)
+        os.replace(tempName, fileName)
+    else:
+        # Also a regular table file that Agent.load can read
+        saveTable(fileName, tuples, agent=state['agent'],
+                  agent_class=state.get('agent_class'), mask=state['mask'],
+                  hyperparameters=state['hyperparameters'], checkpoint=state)
+
+
+def readCheckpoint(directory):
+    '''Read the checkpoint of a checkpoint directory
+    input:
+        directory: Checkpoint directory
+    output: Tuple of the state of the run and the look up table'''
+    fileName = checkpointFile(directory)
+    if readHeader(fileName) is None:
+        with open(fileName, 'rb') as pickleFile:
+            saved = pickle.load(pickleFile)
+        return saved['checkpoint'], saved['tuples']
+    header, tuples = loadTable(fileName)
+    return header['checkpoint'], tuples
+
+
+class Checkpointer(object):
+    '''Takes a checkpoint of an agent every checkpointEvery games. At most one
+    checkpoint is written at a time.'''
+
+    def __init__(self, directory, checkpointEvery, numIterations,
+                 logFile=None):
+        '''Initialize the checkpointer
+        input:
+            directory: Checkpoint directory, created if missing
+            checkpointEvery: Number of games between checkpoints
+            numIterations: Number of games of the whole run
+            logFile: Log file of the run. Its size is recorded so resuming
+                     can drop the records of games played after the
+                     checkpoint.'''
+        if directory is None:
+            raise ValueError('Checkpointing needs a checkpoint directory')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.checkpointEvery = checkpointEvery
+        self.numIterations = numIterations
+        self.logFile = logFile
+        self._thread = None
+        self._error = None
+
+    def due(self, gamesDone):
+        '''Return true if a checkpoint is due after gamesDone games'''
+        return gamesDone % self.checkpointEvery == 0
+
+    def save(self, agent, gamesDone):
+        '''Snapshot the agent and write the snapshot in the background. The
+        log of the run must have been flushed.
+        input:
+            agent: Agent being trained
+            gamesDone: Number of games of the run played so far'''
+        state = {'games': gamesDone, 'num_iterations': self.numIterations,
+                 'checkpoint_every': self.checkpointEvery,
+                 'log_file': self.logFile,
+                 'log_offset': (os.path.getsize(self.logFile)
+                                if self.logFile is not None else None),
+                 'rng': agent._random.getState(), 'agent': agent.name,
+                 'agent_class': type(agent).__name__,
+                 'mask': agent.mask.getTag(),
+                 'hyperparameters': agent.getHyperparameters()}
+        # Copy the table so training can go on updating it
+        tuples = copy.deepcopy(agent.tuples)
+        self.wait()
+        self._thread = threading.Thread(
+            target=self._write, args=(tuples, state), daemon=True)
+        self._thread.start()
+
+    def _write(self, tuples, state):
+        '''Write a snapshot, remembering the error if it fails'''
+        try:
+            writeCheckpoint(checkpointFile(self.directory), tuples, state)
+        except Exception as error:
+            self._error = error
+
+    def wait(self):
+        '''Wait until the checkpoint being written is on disk. Raises the
+        error of a failed write.'''
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
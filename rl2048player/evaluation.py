@@ -0,0 +1,197 @@
+'''Code relating to measuring how well a trained agent plays. The agent is
+frozen: it plays without learning against a read only look up table, which
+the worker processes share instead of copying. Tables loaded with
+agent.load(fileName, mmap=True) are mapped by every worker straight from the
+file, other dense tables are placed in shared memory once.'''
+import copy
+import multiprocessing
+import numpy
+import os
+import time
+from .bitboard import BitGame
+from .masks import EvaluationCache
+from .parallel import shareTable, attachTable, releaseTable
+from .rng import makeGenerator
+from .telemetry import makeRecords
+
+
+# Max tiles whose reach rate is reported
+REACH_TILES = (2048, 4096, 8192)
+# Percentiles of the score distribution that are reported
+PERCENTILES = (5, 25, 50, 75, 95)
+# Number of chunks the games are split into by default
+DEFAULT_CHUNKS = 64
+
+# Agent of a worker process and the memory its table lives in, set by
+# _initWorker
+_workerAgent = None
+_workerTable = None
+
+
+def _tableHandle(tuples):
+    '''Return a handle (see parallel.attachTable) workers can map tuples with
+    read only, and whether the handle has to be released. Tables memory
+    mapped from a file are shared through the file.'''
+    if isinstance(tuples, numpy.memmap) and tuples.filename is not None:
+        return ('map', tuples.filename, tuples.shape, tuples.dtype.str,
+                tuples.offset), False
+    handle, table = shareTable(tuples)
+    del table
+    return handle, True
+
+
+def _attachReadOnly(handle):
+    '''Attach to a table read only
+    input:
+        handle: Handle returned by _tableHandle, with the shared memory
+                replaced by its name
+    output: Tuple of the object keeping the memory alive and the table'''
+    if handle[0] == 'map':
+        _, fileName, shape, dtype, offset = handle
+        table = numpy.memmap(fileName, dtype=dtype, mode='r', offset=offset,
+                             shape=shape)
+        return table, table
+    source, table = attachTable(handle)
+    # Shared memory cannot be mapped read only. Assignments check the flag,
+    # and the agents check it before scattering with numpy.add.at, which
+    # does not.
+    table.flags.writeable = False
+    return source, table
+
+
+def _initWorker(agent, handle):
+    '''Give a worker process the frozen agent
+    input:
+        agent: Agent, without look up table if handle is not None
+        handle: Handle of the shared table or None if the agent brings its
+                own table'''
+    global _workerAgent, _workerTable
+    if handle is not None:
+        _workerTable, agent.tuples = _attachReadOnly(handle)
+    _workerAgent = agent
+
+
+def _evaluateGames(chunk):
+    '''Play a chunk of games with the worker's agent without learning
+    input:
+        chunk: Tuple of number of games and numpy.random.SeedSequence of the
+               chunk
+    output: Records of the games (see telemetry)'''
+    numGames, seed = chunk
+    _workerAgent.seed(seed)
+    scores = numpy.zeros(numGames, dtype=numpy.int64)
+    maxTiles = numpy.zeros(numGames, dtype=numpy.int64)
+    moves = numpy.zeros(numGames, dtype=numpy.int64)
+    wallTimes = numpy.zeros(numGames)
+    for i in range(numGames):
+        game = BitGame(rng=_workerAgent._random)
+        gameStart = time.perf_counter()
+        scores[i] = _workerAgent.play(game=game, learn=False)
+        wallTimes[i] = time.perf_counter() - gameStart
+        maxTiles[i] = 2**int(game.state().max())
+        moves[i] = game.moves()
+    return makeRecords(scores, maxTiles, moves, wallTimes)
+
+
+def summarize(records, wallTime=None):
+    '''Return statistics of played games
+    input:
+        records: Structured array of game records (see telemetry), e.g. read
+                 back from a log with telemetry.readLog
+        wallTime: Seconds all games took together. If None use the sum of the
+                  games' wall times.
+    output: Dictionary of the number of games, the score distribution (mean,
+            std, min, max and percentiles), the fraction of games reaching
+            every tile of REACH_TILES, the number of games ending at every
+            max tile, moves per game and throughput'''
+    scores = records['score']
+    if wallTime is None:
+        wallTime = float(records['wall_time'].sum())
+    numGames = len(records)
+    totalMoves = int(records['moves'].sum())
+    stats = {'games': numGames, 'wall_time': wallTime}
+    if numGames == 0:
+        return stats
+    stats['score'] = {
+        'mean': float(scores.mean()), 'std': float(scores.std()),
+        'min': int(scores.min()), 'max': int(scores.max()),
+        'percentiles': {p: float(v) for p, v in
+                        zip(PERCENTILES, numpy.percentile(scores,
+                                                          PERCENTILES))}}
+    stats['reach_rates'] = {tile: float(numpy.mean(records['max_tile'] >= tile))
+                            for tile in REACH_TILES}
+    tiles, counts = numpy.unique(records['max_tile'], return_counts=True)
+    stats['max_tiles'] = {int(tile): int(count)
+                          for tile, count in zip(tiles, counts)}
+    stats['moves_per_game'] = totalMoves/numGames
+    stats['games_per_sec'] = numGames/max(wallTime, 1e-9)
+    stats['moves_per_sec'] = totalMoves/max(wallTime, 1e-9)
+    return stats
+
+
+def evaluate(agent, num_games=1000, workers=None, chunk_size=None, rng=None,
+             logger=None):
+    '''Play many games with a frozen agent and report how well it plays. The
+    agent does not learn and its look up table is never written to.
+    input:
+        agent: Agent to evaluate
+        num_games: Number of games to play
+        workers: Number of worker processes. If None use one per core. With
+                 one worker the games are played in this process.
+        chunk_size: Number of games a worker plays at a time. If None split
+                    the games into DEFAULT_CHUNKS chunks.
+        rng: numpy.random.Generator or seed the games are drawn from. If None
+             draw a seed from the agent's random numbers. Every chunk of
+             games is seeded from rng, so the games do not depend on which
+             worker plays them or on the number of workers.
+        logger: telemetry.GameLogger the records of every chunk of games are
+                logged to as they finish. It is not closed.
+    output:
+        Tuple of statistics (see summarize) and the records of the games'''
+    if workers is None:
+        workers = os.cpu_count()
+    if chunk_size is None:
+        # Not derived from workers, the chunks decide the games played
+        chunk_size = max(1, -(-num_games // DEFAULT_CHUNKS))
+    chunks = [min(chunk_size, num_games - start)
+              for start in range(0, num_games, chunk_size)]
+    generator = agent._random.generator if rng is None else makeGenerator(rng)
+    seeds = numpy.random.SeedSequence(
+        generator.integers(2**63)).spawn(len(chunks))
+    # Play with a copy, the chunk seeds must not replace the agent's buffer.
+    # It gets its own cache, the workers must not fill the agent's.
+    template = copy.copy(agent)
+    template._cache = EvaluationCache(agent.mask)
+    results = []
+    start = time.perf_counter()
+    if workers == 1:
+        _initWorker(template, None)
+        for records in map(_evaluateGames, zip(chunks, seeds)):
+            if logger is not None:
+                logger.logRecords(records)
+            results.append(records)
+        _initWorker(None, None)
+    else:
+        handle, release = None, False
+        if isinstance(agent.tuples, numpy.ndarray):
+            # Send the agent to the workers without its table
+            handle, release = _tableHandle(agent.tuples)
+            template.tuples = None
+        try:
+            workerHandle = handle
+            if handle is not None and handle[0] == 'shm':
+                workerHandle = ('shm', handle[1].name) + handle[2:]
+            with multiprocessing.Pool(workers, initializer=_initWorker,
+                                      initargs=(template, workerHandle)) \
+                    as pool:
+                for records in pool.imap(_evaluateGames, zip(chunks, seeds)):
+                    if logger is not None:
+                        logger.logRecords(records)
+                    results.append(records)
+        finally:
+            if release:
+                releaseTable(handle)
+    wallTime = time.perf_counter() - start
+    records = numpy.concatenate(results) if results else makeRecords([], [],
+                                                                      [], [])
+    return summarize(records, wallTime), records
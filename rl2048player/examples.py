@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 from .agents import QAgent, TD0Agent, SARSAAgent
 from .masks import Mask_rxcx4
 
@@ -14,6 +13,7 @@ def example1(q_gif_file='example_output/example1/QGame.gif',
         td0_gif_file: File to save gif of td0 agent game
         sarsa_gif_file: File to save gif of sarsa game
         graph_file: File to save graph'''
+    import matplotlib.pyplot as plt
     # Initialize mask
     mask = Mask_rxcx4()
     # Initialize Agents
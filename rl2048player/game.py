@@ -2,12 +2,21 @@
    Game class to represent 2048 game state."""
 
 import numpy
+from .rng import makeRandom
 
 
 ACTION_LEFT = 0
 ACTION_UP = 1
 ACTION_RIGHT = 2
 ACTION_DOWN = 3
+# Actions of every legal action bitmask, see Game.legal_actions
+_LEGAL_ACTION_LISTS = [[action for action in range(4) if (legal >> action) & 1]
+                       for legal in range(16)]
+
+
+def legal_action_list(legal):
+    """Return the list of the actions set in a legal action bitmask."""
+    return list(_LEGAL_ACTION_LISTS[legal])
 
 
 class Game(object):
@@ -17,16 +26,20 @@ class Game(object):
     Game states are represented as shape (boardSize, boardSize) numpy arrays 
     whose entries are 0 for empty fields and ln2(value) for any tiles."""
 
-    def __init__(self, state=None, initial_score=0, boardSize=4):
+    def __init__(self, state=None, initial_score=0, boardSize=4, rng=None):
         """Init the Game object.
         Args:
           state: Shape (boardSize, boardSize) numpy array to initialize the state with. If None
               the state will be initialized with with two random tiles (as done
               in the original game).
           initial_score: Score to initialize the Game with.
-          boardSize: Game board is of size boardSize X boardSize"""
+          boardSize: Game board is of size boardSize X boardSize
+          rng: numpy.random.Generator, seed or rng.RandomBuffer the random
+              tiles are drawn from. Copies of the game share it."""
         self._score = initial_score
+        self._moves = 0
         self.boardSize = boardSize
+        self._random = makeRandom(rng)
         # If state is none add two random tiles
         if state is None:
             self._state = numpy.zeros((boardSize, boardSize), dtype=numpy.int)
@@ -37,18 +50,38 @@ class Game(object):
 
     def copy(self):
         """Return a copy of self."""
-        return Game(numpy.copy(self._state), self._score)
+        game = Game(numpy.copy(self._state), self._score, self.boardSize,
+                    self._random)
+        game._moves = self._moves
+        return game
 
     def game_over(self):
         """Return true if game is over"""
-        for action in range(4):
-            if self.is_action_available(action):
-                return False
-        return True
+        return self.legal_actions() == 0
 
     def available_actions(self):
         """Computes the set of actions that are available."""
-        return [action for action in range(4) if self.is_action_available(action)]
+        return legal_action_list(self.legal_actions())
+
+    def legal_actions(self):
+        """Computes the bitmask of the available actions, bit action being
+        set if action is available. Zero if the game is over."""
+        state = self._state
+        occupied = state != 0
+        # Equal neighbours can be merged both ways, a tile with an empty
+        # field next to it can move there
+        row_merge = numpy.any(occupied[:, 1:] & (state[:, 1:] == state[:, :-1]))
+        col_merge = numpy.any(occupied[1:] & (state[1:] == state[:-1]))
+        legal = 0
+        if row_merge or numpy.any(occupied[:, 1:] & ~occupied[:, :-1]):
+            legal |= 1 << ACTION_LEFT
+        if row_merge or numpy.any(occupied[:, :-1] & ~occupied[:, 1:]):
+            legal |= 1 << ACTION_RIGHT
+        if col_merge or numpy.any(occupied[1:] & ~occupied[:-1]):
+            legal |= 1 << ACTION_UP
+        if col_merge or numpy.any(occupied[:-1] & ~occupied[1:]):
+            legal |= 1 << ACTION_DOWN
+        return legal
 
     def is_action_available(self, action):
         """Determines whether action is available.
@@ -77,6 +110,7 @@ class Game(object):
         reward = self._do_action_left(temp_state)
         self._state = numpy.rot90(temp_state, -action)
         self._score += reward
+        self._moves += 1
         return reward
 
     def _do_action_left(self, state):
@@ -109,8 +143,8 @@ class Game(object):
         """Adds a random tile to the grid. Assumes that it has empty fields."""
         x_pos, y_pos = numpy.where(self._state == 0)
         assert len(x_pos) != 0
-        empty_index = numpy.random.choice(len(x_pos))
-        value = numpy.random.choice([1, 2], p=[0.9, 0.1])
+        empty_index = self._random.randrange(len(x_pos))
+        value = 1 if self._random.random() < 0.9 else 2
         self._state[x_pos[empty_index], y_pos[empty_index]] = value
 
     def state(self):
@@ -120,3 +154,7 @@ class Game(object):
     def score(self):
         """Return current score."""
         return self._score
+
+    def moves(self):
+        """Return number of actions executed so far."""
+        return self._moves
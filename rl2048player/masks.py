@@ -1,11 +1,37 @@
 '''Code relating to the mask learning agents use to understand the game'''
 import numpy
 from abc import ABC, abstractmethod
+from .batch import unpackBoards
+from .bitboard import changedCells, countChangedCells
+from .game import ACTION_LEFT, ACTION_UP, ACTION_RIGHT, ACTION_DOWN
+
+
+# Direction (row, col) each action moves the tiles in
+_ACTION_DIRECTIONS = {ACTION_LEFT: (0, -1), ACTION_UP: (-1, 0),
+                      ACTION_RIGHT: (0, 1), ACTION_DOWN: (1, 0)}
+
+
+def boardSymmetries(boardSize):
+    '''Return the 8 symmetries of the board (4 rotations, each with and
+    without a reflection) as functions mapping (row, col) to (row, col)'''
+    n = boardSize - 1
+    return [lambda r, c: (r, c), lambda r, c: (c, n - r),
+            lambda r, c: (n - r, n - c), lambda r, c: (n - c, r),
+            lambda r, c: (r, n - c), lambda r, c: (n - r, c),
+            lambda r, c: (c, r), lambda r, c: (n - c, n - r)]
 
 
 class Mask(ABC):
     '''Abstract class identifing the functions a mask class needs'''
 
+    # Largest number of changed cells updateTupleNums updates cell by cell.
+    # When more cells changed the tuple nums are computed from scratch,
+    # which is cheaper then.
+    maxUpdateCells = 3
+    # Change of the tuple nums per cell and change of its tile, set by
+    # _setTupleLayout
+    _layoutCellDeltas = None
+
     def __init__(self, name, boardSize=4, maxTile=15):
         '''Init the mask class
         input:
@@ -38,43 +64,401 @@ class Mask(ABC):
         '''Return tag of mask'''
         return self.name
 
+    def getActionMap(self):
+        '''Return (numTuples, 4) array giving for each tuple the action its
+        weights are stored under when action is taken on the board, or None
+        if weights are stored under the action itself. Only differs from None
+        for masks that share weights between symmetric tuples.'''
+        return getattr(self, '_actionMap', None)
+
+    def getBoardTupleNums(self, boards):
+        '''Transforms packed boards (see bitboard) into their tuple number
+        representation
+        input:
+            boards: Packed board or array of packed boards
+        output: array of tuple nums, with one more dimension than boards'''
+        return self.getTupleNums(unpackBoards(boards))
+
+    def updateTupleNums(self, tupleNums, prevState, state, cells=None):
+        '''Turn the tuple nums of prevState into those of state. Only the
+        tuples holding a cell that changed are recomputed, so after a tile
+        spawn or a move touching few rows the cost follows the number of
+        changed cells.
+        input:
+            tupleNums: Tuple nums of prevState
+            prevState: State tupleNums belong to
+            state: State to get the tuple nums of
+            cells: Flat indices (row*boardSize + col) of the cells that
+                   differ between the states. If None compare the states.
+        output: array of tuple nums corresponding to state'''
+        prevState = numpy.asarray(prevState)
+        state = numpy.asarray(state)
+        if cells is None:
+            cells = (prevState != state).ravel().nonzero()[0]
+        if self._layoutCellDeltas is None or len(cells) > self.maxUpdateCells:
+            return self.getTupleNums(state)
+        for cell in cells:
+            tupleNums = tupleNums + self._layoutCellDeltas[cell][
+                state.item(cell) - prevState.item(cell) + self.maxTile]
+        return tupleNums
+
+    def updateBoardTupleNums(self, tupleNums, prevBoard, board):
+        '''Turn the tuple nums of packed board prevBoard into those of
+        packed board board (see bitboard), recomputing only the tuples holding
+        a cell that changed
+        input:
+            tupleNums: Tuple nums of prevBoard
+            prevBoard: Packed board tupleNums belong to
+            board: Packed board to get the tuple nums of
+        output: array of tuple nums corresponding to board'''
+        if self._layoutCellDeltas is None or \
+                countChangedCells(prevBoard, board) > self.maxUpdateCells:
+            return self.getBoardTupleNums(board)
+        cells, prevValues, values = changedCells(prevBoard, board)
+        for cell, prevValue, value in zip(cells, prevValues, values):
+            tupleNums = tupleNums + self._layoutCellDeltas[cell][
+                value - prevValue + self.maxTile]
+        return tupleNums
+
+    def evaluate(self, tuples, state):
+        '''Add up the values of the tuple nums of one or many states
+        input:
+            tuples: Look up table
+            state: State, or (N, boardSize, boardSize) batch of states
+        output: Value of state, (N,) values for a batch of states. Tables
+                with one column per action give one value per action.'''
+        tupleNums = self.getTupleNums(state)
+        return tuples[tupleNums].sum(axis=tupleNums.ndim - 1)
+
+    def update(self, tuples, tupleNums, delta):
+        '''Add delta to the values of tupleNums. Repeated tuple nums are all
+        updated, like numpy.add.at.
+        input:
+            tuples: Look up table
+            tupleNums: Array of tuple nums
+            delta: Value to add, broadcastable to tuples[tupleNums]'''
+        if isinstance(tuples, numpy.ndarray):
+            # numpy.add.at does not check the flag itself
+            if not tuples.flags.writeable:
+                raise ValueError('Look up table is read only')
+            numpy.add.at(tuples, tupleNums, delta)
+        else:
+            tuples.add(tupleNums, delta)
+
+    def _setTupleLayout(self, cells, offsets, base=16):
+        '''Precompute the index layout used by _gatherTupleNums. The tuple num
+        of tuple i is offsets[i] plus the tiles at cells[i] read as the digits
+        of a base base number, first cell being the most significant digit.
+        input:
+            cells: List with the (row, col) coordinates of each tuple
+            offsets: Offset added to the tuple num of each tuple
+            base: Base of the digits. Must be larger than maxTile.'''
+        # Shorter tuples are padded at the front with an extra cell that is
+        # always empty, so all tuples can be gathered as one array
+        length = max(len(tupleCells) for tupleCells in cells)
+        padding = self.boardSize**2
+        self._layoutPadded = any(len(tupleCells) < length for tupleCells in
+                                 cells)
+        self._layoutGather = numpy.array(
+            [[padding]*(length - len(tupleCells)) +
+             [row*self.boardSize + col for row, col in tupleCells]
+             for tupleCells in cells], dtype=numpy.intp)
+        self._layoutWeights = base**numpy.arange(length-1, -1, -1,
+                                                 dtype=numpy.int64)
+        # Weight of every cell's tile in the tuple num of every tuple
+        cellWeights = numpy.zeros((padding, len(cells)), dtype=numpy.int64)
+        for tupleIndex, tupleCells in enumerate(cells):
+            for (row, col), weight in zip(
+                    tupleCells, self._layoutWeights[length-len(tupleCells):]):
+                cellWeights[row*self.boardSize + col, tupleIndex] += weight
+        # Change of the tuple nums when a cell's tile changes by d, stored
+        # under [cell][d + maxTile], for updating tuple nums cell by cell
+        deltas = numpy.arange(-self.maxTile, self.maxTile + 1)
+        self._layoutCellDeltas = [list(deltas[:, None]*cellWeights[cell])
+                                  for cell in range(padding)]
+        self._layoutOffsetArray = numpy.array(offsets, dtype=numpy.int64)
+        self._numLayoutTuples = len(cells)
+        self._layoutCells = [list(tupleCells) for tupleCells in cells]
+        self._layoutOffsets = [int(offset) for offset in offsets]
+        self._layoutBase = base
+
+    def _setSymmetricTupleLayout(self, cells, base=16):
+        '''Precompute a layout in which symmetric tuples share weights. The
+        tuples are grouped into classes of tuples that a board symmetry maps
+        onto each other. The first tuple of each class is read in all 8
+        symmetric ways and all of them use the same block of tuple nums.
+        input:
+            cells: List with the (row, col) coordinates of each tuple
+            base: Base of the digits. Must be larger than maxTile.
+        output: Number of tuple nums, i.e. the size of the table'''
+        symmetries = boardSymmetries(self.boardSize)
+        board = [(row, col) for row in range(self.boardSize)
+                 for col in range(self.boardSize)]
+        # Find the first tuple of each class
+        representatives = {}
+        for tupleCells in cells:
+            key = min(tuple(sorted(symmetry(*cell) for cell in tupleCells))
+                      for symmetry in symmetries)
+            representatives.setdefault(key, tupleCells)
+        symmetricCells = []
+        offsets = []
+        actionMap = []
+        tableSize = 0
+        for tupleCells in representatives.values():
+            for symmetry in symmetries:
+                symmetricCells.append([symmetry(*cell) for cell in tupleCells])
+                offsets.append(tableSize)
+                # Reading the tuple at symmetry(cells) is reading it at cells
+                # on the board transformed by the inverse symmetry, where a
+                # move in direction d becomes a move in inverse(d)
+                inverse = {symmetry(*cell): cell for cell in board}
+                tupleActions = []
+                for action in range(4):
+                    dRow, dCol = _ACTION_DIRECTIONS[action]
+                    start = (max(0, -dRow), max(0, -dCol))
+                    begin = inverse[start]
+                    end = inverse[(start[0] + dRow, start[1] + dCol)]
+                    direction = (end[0] - begin[0], end[1] - begin[1])
+                    tupleActions.extend(
+                        mapped for mapped, mappedDirection in
+                        _ACTION_DIRECTIONS.items()
+                        if mappedDirection == direction)
+                actionMap.append(tupleActions)
+            tableSize += base**len(tupleCells)
+        self._setTupleLayout(symmetricCells, offsets, base)
+        self._actionMap = numpy.array(actionMap, dtype=numpy.intp)
+        return tableSize
+
+    def _gatherTupleNums(self, state):
+        '''Compute the tuple nums of one or many states with the layout set by
+        _setTupleLayout
+        input:
+            state: (boardSize, boardSize) state or (N, boardSize, boardSize)
+                   batch of states
+        output: (numTuples,) or (N, numTuples) array of tuple nums'''
+        state = numpy.asarray(state, dtype=numpy.int64)
+        flat = state.reshape(state.shape[:-2] + (self.boardSize**2,))
+        if self._layoutPadded:
+            flat = numpy.concatenate(
+                (flat, numpy.zeros(flat.shape[:-1] + (1,), numpy.int64)),
+                axis=-1)
+        return (flat[..., self._layoutGather] @ self._layoutWeights +
+                self._layoutOffsetArray)
+
     def getBoardSize(self):
         '''Return the boardSize'''
         return self.boardSize
 
 
+class EvaluationCache(object):
+    '''Remembers the tuple nums and values of the last few states an agent
+    looked at, so a state looked up several times while choosing an action
+    and learning from it is only transformed and summed once. A state that
+    follows a cached one by a known change (e.g. a tile spawn) gets its tuple
+    nums from Mask.updateTupleNums. Values depend on the look up table, so
+    invalidate has to be called whenever the table changes.'''
+
+    def __init__(self, mask, size=16):
+        '''Init the cache
+        input:
+            mask: Mask computing the tuple nums
+            size: Number of states remembered'''
+        self.mask = mask
+        self.size = size
+        self._tupleNums = {}
+        self._values = {}
+        self._expected = None
+
+    def get(self, state):
+        '''Return the tuple nums of a state'''
+        state = numpy.asarray(state)
+        return self._get(state.tobytes(), state)
+
+    def getValue(self, state, evaluate):
+        '''Return the value of a state
+        input:
+            state: State to look up
+            evaluate: Function adding up the values of the state's tuple nums
+        output: Value returned by evaluate. Must not be modified.'''
+        state = numpy.asarray(state)
+        key = state.tobytes()
+        value = self._values.get(key)
+        if value is None:
+            value = evaluate(self._get(key, state))
+            self._store(self._values, key, value)
+        return value
+
+    def add(self, state, tupleNums, value=None):
+        '''Remember the tuple nums (and value) of a state computed
+        elsewhere'''
+        key = state.tobytes()
+        self._store(self._tupleNums, key, tupleNums)
+        if value is not None:
+            self._store(self._values, key, value)
+
+    def expect(self, prevState, state, cells):
+        '''Announce that state, which differs from prevState only in cells,
+        is looked up next. If prevState is cached the tuple nums of state are
+        then updated from it instead of computed.
+        input:
+            prevState: State that may be cached
+            state: State expected to be looked up
+            cells: Flat indices of the cells that differ'''
+        self._expected = (state.tobytes(), prevState, cells)
+
+    def invalidate(self):
+        '''Forget all values, e.g. after the look up table changed'''
+        self._values.clear()
+
+    def clear(self):
+        '''Forget all states'''
+        self._tupleNums.clear()
+        self._values.clear()
+        self._expected = None
+
+    def _get(self, key, state):
+        '''Return the tuple nums of a state with key key'''
+        tupleNums = self._tupleNums.get(key)
+        if tupleNums is None:
+            tupleNums = self._compute(key, state)
+            self._store(self._tupleNums, key, tupleNums)
+        return tupleNums
+
+    def _compute(self, key, state):
+        '''Compute the tuple nums of a state that is not cached'''
+        expected, self._expected = self._expected, None
+        if expected is not None and expected[0] == key:
+            _, prevState, cells = expected
+            prevNums = self._tupleNums.get(prevState.tobytes())
+            if prevNums is not None:
+                return self.mask.updateTupleNums(prevNums, prevState, state,
+                                                 cells)
+        return self.mask.getTupleNums(state)
+
+    def _store(self, entries, key, entry):
+        '''Remember an entry, forgetting the oldest one when full'''
+        entries[key] = entry
+        if len(entries) > self.size:
+            del entries[next(iter(entries))]
+
+
+def migrateTable(tuples, fromMask, toMask, dtype=None):
+    '''Convert a look up table between two masks that describe the same
+    tuples with different numberings, e.g. a table trained with
+    Mask_rxcx4() to one for Mask_rxcx4(compact=True).
+    input:
+        tuples: Look up table indexed by the tuple nums of fromMask. Extra
+                dimensions (e.g. actions) are kept.
+        fromMask: Mask the table was built for
+        toMask: Mask to build the new table for
+        dtype: dtype of the new table. If None keep the dtype of tuples.
+    output: Look up table indexed by the tuple nums of toMask'''
+    if fromMask._layoutCells != toMask._layoutCells:
+        raise ValueError('Masks ' + fromMask.getTag() + ' and ' +
+                         toMask.getTag() + ' use different tuples')
+    tuples = numpy.asarray(tuples)
+    if dtype is None:
+        dtype = tuples.dtype
+    newTuples = numpy.zeros((toMask.getMaxTupleNum(),) + tuples.shape[1:],
+                            dtype=dtype)
+    numTiles = min(fromMask.maxTile, toMask.maxTile) + 1
+    for cells, fromOffset, toOffset in zip(fromMask._layoutCells,
+                                           fromMask._layoutOffsets,
+                                           toMask._layoutOffsets):
+        # Every combination of tiles this tuple can hold
+        length = len(cells)
+        combos = numpy.indices((numTiles,)*length).reshape(length, -1).T
+        powers = numpy.arange(length-1, -1, -1)
+        fromNums = fromOffset + combos @ (fromMask._layoutBase**powers)
+        toNums = toOffset + combos @ (toMask._layoutBase**powers)
+        # Legacy tables are one entry shorter than their largest tuple num
+        inRange = (fromNums < len(tuples)) & (toNums < len(newTuples))
+        newTuples[toNums[inRange]] = tuples[fromNums[inRange]]
+    return newTuples
+
+
 class Mask_rxcx4(Mask):
     '''Mask that analyzes the states by looking at each row, column, and 4x4 squares.'''
 
-    def __init__(self, name='4x4x4', boardSize=4, maxTile=15):
+    def __init__(self, name=None, boardSize=4, maxTile=15, compact=False,
+                 symmetric=False):
         '''Init the mask class
         input:
-            name: Name of mask used for tag
+            name: Name of mask used for tag. Defaults to 4x4x4, with a c
+                  appended for a compact and an s for a symmetric mask.
             boardSize: Size of the board
-            maxTile: log2 of max tile that can appear on board'''
+            maxTile: log2 of max tile that can appear on board
+            compact: If true each tuple gets a contiguous block of
+                     (maxTile+1)**tupleLength tuple nums instead of the hex
+                     numbering of stateToTupleNum, which leaves most of the
+                     look up table unused
+            symmetric: If true tuples that are rotations or reflections of
+                       each other share their weights, and every tuple is
+                       read in all 8 symmetric ways (e.g. 40 tuple nums from 5
+                       weight blocks on a 4x4 board). Implies compact.'''
+        if name is None:
+            name = '4x4x4' + ('s' if symmetric else 'c' if compact else '')
         super().__init__(name, boardSize, maxTile)
+        self.compact = compact or symmetric
+        self.symmetric = symmetric
         # Define some flags to specify the tuple types
         self.row_flag = 0
         self.column_flag = 1
         self.square_flag = 2
+        # Precompute which cells make up each tuple and the leading hex digits
+        # (tuple type and index) stateToTupleNum gives each tuple
+        cells = []
+        offsets = []
+        self._tableSize = 0
+        for tupleType, tupleIndex in self._tupleTypesAndIndices():
+            tupleCells = self._tupleCells(tupleType, tupleIndex)
+            cells.append(tupleCells)
+            if symmetric:
+                continue
+            if compact:
+                offsets.append(self._tableSize)
+                self._tableSize += (maxTile + 1)**len(tupleCells)
+            else:
+                prefix = ''.join(['{:x}'.format(tupleType),
+                                  '{:x}'.format(tupleIndex)])
+                offsets.append(int(prefix, base=16) << 4*len(tupleCells))
+        if symmetric:
+            self._tableSize = self._setSymmetricTupleLayout(cells,
+                                                            maxTile + 1)
+        elif compact:
+            self._setTupleLayout(cells, offsets, maxTile + 1)
+        else:
+            self._setTupleLayout(cells, offsets)
 
     def getNumTuples(self):
         '''Return the number of tuples used to describe each state'''
+        if self.symmetric:
+            return self._numLayoutTuples
         return 2*self.boardSize + (self.boardSize-1)**2
 
     def getMaxTupleNum(self):
-        '''Return the largest number corresponding to a tuple'''
+        '''Return the largest number corresponding to a tuple. For a compact
+        mask this is the number of tuple nums, i.e. the size of the table.'''
+        if self.compact:
+            return self._tableSize
         return self.stateToTupleNum(numpy.full((self.boardSize,
                                     self.boardSize), self.maxTile),
                                     self.square_flag,(self.boardSize-1)**2-1)
 
     def getTupleNums(self, state):
-        '''Transforms a state into its tuple number representation
+        '''Transforms a state into its tuple number representation. Unless the
+        mask is compact, gives the same numbers as calling stateToTupleNum for
+        every tuple.
         input:
-            state: state to transform
-        output: array of tuple nums corresponding to state'''
-        tupleNums = numpy.zeros(self.getNumTuples(), dtype=numpy.int)
-        index = 0
+            state: state to transform, or (N, boardSize, boardSize) batch of
+                   states
+        output: array of tuple nums corresponding to state, (N, numTuples)
+                for a batch of states'''
+        return self._gatherTupleNums(state)
+
+    def _tupleTypesAndIndices(self):
+        '''Return list of (tupleType, tupleIndex) pairs in tuple num order'''
+        pairs = []
         # For each tuple type
         for tupleType in range(self.square_flag+1):
             # If tuple type is row or column there will be boardSize tuples
@@ -86,11 +470,20 @@ class Mask_rxcx4(Mask):
                 maxNum = (self.boardSize - 1)**2
             # For each tuple of this type
             for tupleIndex in range(maxNum):
-                # Record this tuple num
-                tupleNums[index] = self.stateToTupleNum(state, tupleType, tupleIndex)
-                # Increment index
-                index += 1
-        return tupleNums
+                pairs.append((tupleType, tupleIndex))
+        return pairs
+
+    def _tupleCells(self, tupleType, tupleIndex):
+        '''Return list of (row, col) coordinates of the cells in a tuple, in
+        the order stateToTupleNum reads them'''
+        if(tupleType == self.row_flag):
+            return [(tupleIndex, col) for col in range(self.boardSize)]
+        elif(tupleType == self.column_flag):
+            return [(row, tupleIndex) for row in range(self.boardSize)]
+        elif(tupleType == self.square_flag):
+            basex = tupleIndex % (self.boardSize - 1)
+            basey = int(tupleIndex / (self.boardSize - 1))
+            return [(basex + i, basey + j) for i in range(2) for j in range(2)]
 
     def stateToTupleNum(self, state, tupleType, tupleIndex):
         '''Get specific tupleNum for a state. Accomplished by creating a base
@@ -117,3 +510,77 @@ class Mask_rxcx4(Mask):
                                   for i in range(2) for j in range(2)])
         # Return the hexString as as a decimal integer
         return int(hexString, base=16)
+
+
+# Tuple layouts from the n-tuple network literature, given as flat cell
+# indices (row*4 + col) on a 4x4 board
+NTUPLE_PRESETS = {
+    # Two straight 4-tuples and two 2x3 rectangles (Szubert and Jaskowski)
+    '2x4+2x6': [[0, 1, 2, 3], [4, 5, 6, 7],
+                [0, 1, 2, 4, 5, 6], [4, 5, 6, 8, 9, 10]],
+    # Four 6-tuples (Yeh et al.)
+    '4x6': [[0, 1, 2, 3, 4, 5], [4, 5, 6, 7, 8, 9],
+            [0, 1, 2, 4, 5, 6], [4, 5, 6, 8, 9, 10]],
+    # Eight 6-tuples
+    '8x6': [[0, 1, 2, 3, 4, 5], [4, 5, 6, 7, 8, 9],
+            [0, 1, 2, 4, 5, 6], [4, 5, 6, 8, 9, 10],
+            [0, 1, 5, 6, 7, 10], [0, 1, 2, 5, 9, 10],
+            [0, 1, 5, 9, 13, 14], [0, 1, 5, 8, 9, 13]]}
+
+
+class NTupleMask(Mask):
+    '''Mask that analyzes the states by looking at a configurable list of
+    n-tuples, i.e. lists of cells whose tiles are read together.'''
+
+    def __init__(self, tuples='4x6', name=None, boardSize=4, maxTile=15,
+                 symmetric=True):
+        '''Init the mask class
+        input:
+            tuples: Name of a layout in NTUPLE_PRESETS, or list of tuples
+                    where each tuple is a list of (row, col) coordinates
+            name: Name of mask used for tag. Defaults to the preset name, or
+                  nt followed by the tuple lengths, with an s appended for a
+                  symmetric mask.
+            boardSize: Size of the board
+            maxTile: log2 of max tile that can appear on board
+            symmetric: If true tuples are read in all 8 symmetric ways and
+                       symmetric tuples share their weights'''
+        if isinstance(tuples, str):
+            if name is None:
+                name = tuples
+            tuples = [[divmod(cell, 4) for cell in preset] for preset in
+                      NTUPLE_PRESETS[tuples]]
+        elif name is None:
+            name = 'nt' + '-'.join(str(len(cells)) for cells in tuples)
+        if symmetric:
+            name += 's'
+        super().__init__(name, boardSize, maxTile)
+        self.tuples = [[tuple(cell) for cell in cells] for cells in tuples]
+        self.symmetric = symmetric
+        if symmetric:
+            self._tableSize = self._setSymmetricTupleLayout(self.tuples,
+                                                            maxTile + 1)
+        else:
+            offsets = []
+            self._tableSize = 0
+            for cells in self.tuples:
+                offsets.append(self._tableSize)
+                self._tableSize += (maxTile + 1)**len(cells)
+            self._setTupleLayout(self.tuples, offsets, maxTile + 1)
+
+    def getNumTuples(self):
+        '''Return the number of tuples used to describe each state'''
+        return self._numLayoutTuples
+
+    def getMaxTupleNum(self):
+        '''Return the number of tuple nums, i.e. the size of the table'''
+        return self._tableSize
+
+    def getTupleNums(self, state):
+        '''Transforms a state into its tuple number representation
+        input:
+            state: state to transform, or (N, boardSize, boardSize) batch of
+                   states
+        output: array of tuple nums corresponding to state, (N, numTuples)
+                for a batch of states'''
+        return self._gatherTupleNums(state)
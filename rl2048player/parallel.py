@@ -0,0 +1,149 @@
+'''Code relating to training one agent with many processes. The look up table
+is placed in shared memory (or a memory mapped file) and every worker process
+plays games and updates the shared table without locks (Hogwild style).'''
+import copy
+import multiprocessing
+import numpy
+import os
+import tempfile
+from multiprocessing import shared_memory
+from .telemetry import MemoryLogger
+
+
+# Table and agent of a worker process, set by _initWorker
+_workerAgent = None
+_workerTable = None
+
+
+def shareTable(tuples, useFile=False, directory=None):
+    '''Copy a look up table into memory that can be shared between processes
+    input:
+        tuples: Look up table to share
+        useFile: If true back the table by a memory mapped file instead of a
+                 shared memory block
+        directory: Directory for the memory mapped file. If None use the
+                   default temporary directory.
+    output: Tuple of handle (describes how to attach to the table, see
+            attachTable) and the shared table'''
+    tuples = numpy.asarray(tuples)
+    if useFile:
+        fd, path = tempfile.mkstemp(suffix='.table', dir=directory)
+        os.close(fd)
+        table = numpy.memmap(path, dtype=tuples.dtype, mode='w+',
+                             shape=tuples.shape)
+        handle = ('file', path, tuples.shape, tuples.dtype.str)
+    else:
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(tuples.nbytes, 1))
+        table = numpy.ndarray(tuples.shape, dtype=tuples.dtype,
+                              buffer=shm.buf)
+        handle = ('shm', shm, tuples.shape, tuples.dtype.str)
+    table[...] = tuples
+    return handle, table
+
+
+def attachTable(handle):
+    '''Attach to a table shared by shareTable
+    input:
+        handle: Handle returned by shareTable
+    output: Tuple of the object keeping the memory alive and the table'''
+    kind, source, shape, dtype = handle
+    if kind == 'file':
+        table = numpy.memmap(source, dtype=dtype, mode='r+', shape=shape)
+        return table, table
+    shm = shared_memory.SharedMemory(name=source)
+    return shm, numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def releaseTable(handle):
+    '''Free the memory of a table shared by shareTable
+    input:
+        handle: Handle returned by shareTable'''
+    kind, source, _, _ = handle
+    if kind == 'file':
+        os.remove(source)
+    else:
+        source.close()
+        source.unlink()
+
+
+def _initWorker(agent, handle):
+    '''Attach a worker process to the shared table
+    input:
+        agent: Agent without look up table
+        handle: Handle of the shared table, with the shared memory replaced
+                by its name'''
+    global _workerAgent, _workerTable
+    _workerTable, agent.tuples = attachTable(handle)
+    _workerAgent = agent
+
+
+def _playGames(chunk):
+    '''Train the worker's agent over a chunk of games
+    input:
+        chunk: Tuple of number of games and numpy.random.SeedSequence of the
+               chunk. Seeding per chunk instead of per process makes the
+               games independent of which worker plays them.
+    output: Records of the games (see telemetry)'''
+    numGames, seed = chunk
+    logger = MemoryLogger()
+    _workerAgent.train(numGames, rng=seed, logger=logger)
+    return logger.records()
+
+
+def trainParallel(agent, numIterations=1000, workers=None, chunkSize=None,
+                  mmapWorkers=16, directory=None, logger=None):
+    '''Train agent over many games played by several processes that all update
+    the same look up table.
+    input:
+        agent: Agent to train. Its table is updated in place.
+        numIterations: Number of games to play
+        workers: Number of worker processes. If None use one per core.
+        chunkSize: Number of games a worker plays before reporting its scores.
+                   If None split the games into four chunks per worker.
+        mmapWorkers: Use a memory mapped file instead of a shared memory block
+                     when there are at least this many workers
+        directory: Directory for the memory mapped file
+        logger: telemetry.GameLogger the records of every chunk of games are
+                logged to as soon as it finishes
+    output:
+        final score of games'''
+    if not isinstance(agent.tuples, numpy.ndarray):
+        raise TypeError('Parallel training needs a dense look up table')
+    if workers is None:
+        workers = os.cpu_count()
+    if chunkSize is None:
+        chunkSize = max(1, -(-numIterations // (4*workers)))
+    chunks = [min(chunkSize, numIterations - start)
+              for start in range(0, numIterations, chunkSize)]
+    handle, table = shareTable(agent.tuples, workers >= mmapWorkers,
+                               directory)
+    tuples = agent.tuples
+    try:
+        # Send the agent to the workers without its table
+        template = copy.copy(agent)
+        template.tuples = None
+        if handle[0] == 'shm':
+            workerHandle = ('shm', handle[1].name) + handle[2:]
+        else:
+            workerHandle = handle
+        # Seed the chunks from the agent, a seeded agent repeats its run
+        seeds = numpy.random.SeedSequence(
+            agent._random.generator.integers(2**63)).spawn(len(chunks))
+        with multiprocessing.Pool(workers, initializer=_initWorker,
+                                  initargs=(template, workerHandle)) as pool:
+            results = []
+            for records in pool.imap(_playGames, zip(chunks, seeds)):
+                if logger is not None:
+                    logger.logRecords(records)
+                results.append(records['score'])
+        # Copy the trained table back into the agent
+        tuples[...] = table
+    finally:
+        # Drop the view first, closing the shared memory while it exists
+        # raises BufferError and hides the exception of the training
+        del table
+        releaseTable(handle)
+    if len(results) == 0:
+        return numpy.zeros(0, dtype=numpy.int32)
+    return numpy.concatenate(results).astype(numpy.int32)
@@ -0,0 +1,83 @@
+'''Code relating to saving and loading look up tables.
+   A table file starts with an 8 byte magic string and a 4 byte little endian
+   header length, followed by a JSON header (format version, tags,
+   hyperparameters, dtype, shape) padded so that the raw table, stored in C
+   order right after it, starts on a 64 byte boundary. The table can then be
+   memory mapped without copying it.'''
+import json
+import numpy
+import os
+import pickle
+import struct
+
+
+MAGIC = b'RL2048T\n'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def saveTable(fileName, tuples, **header):
+    '''Save a look up table
+    input:
+        fileName: Save file
+        tuples: Look up table
+        header: Additional JSON serializable entries for the header'''
+    tuples = numpy.ascontiguousarray(tuples)
+    header = dict(header, version=VERSION, dtype=tuples.dtype.str,
+                  shape=list(tuples.shape))
+    headerBytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    # Pad the header so the table starts on an aligned offset
+    start = len(MAGIC) + 4 + len(headerBytes)
+    headerBytes += b' '*(-start % ALIGNMENT)
+    # Write to a temporary file first so a crash never leaves a partial file
+    tempName = fileName + '.tmp'
+    with open(tempName, 'wb') as tableFile:
+        tableFile.write(MAGIC)
+        tableFile.write(struct.pack('<I', len(headerBytes)))
+        tableFile.write(headerBytes)
+        tableFile.write(tuples.data)
+    os.replace(tempName, fileName)
+
+
+def readHeader(fileName):
+    '''Read the header of a table file
+    input:
+        fileName: Save file
+    output: Header dictionary, with the offset of the table added as
+            'offset'. None if the file is not a table file (e.g. a legacy
+            pickle).'''
+    with open(fileName, 'rb') as tableFile:
+        if tableFile.read(len(MAGIC)) != MAGIC:
+            return None
+        length, = struct.unpack('<I', tableFile.read(4))
+        header = json.loads(tableFile.read(length).decode('utf-8'))
+    if header['version'] > VERSION:
+        raise ValueError(fileName + ' has unsupported version ' +
+                         str(header['version']))
+    header['offset'] = len(MAGIC) + 4 + length
+    return header
+
+
+def loadTable(fileName, mmap=False):
+    '''Load a look up table saved by saveTable or pickled by older versions
+    input:
+        fileName: Save file
+        mmap: If true memory map the table read only instead of reading it.
+              Processes mapping the same file share one copy of it.
+    output: Tuple of header (None for legacy pickles) and look up table'''
+    header = readHeader(fileName)
+    if header is None:
+        with open(fileName, 'rb') as pickleFile:
+            return None, pickle.load(pickleFile)
+    dtype = numpy.dtype(header['dtype'])
+    shape = tuple(header['shape'])
+    if mmap:
+        tuples = numpy.memmap(fileName, dtype=dtype, mode='r',
+                              offset=header['offset'], shape=shape)
+    else:
+        with open(fileName, 'rb') as tableFile:
+            tableFile.seek(header['offset'])
+            tuples = numpy.fromfile(tableFile, dtype=dtype,
+                                    count=int(numpy.prod(shape)))
+        tuples = tuples.reshape(shape)
+    return header, tuples
@@ -0,0 +1,144 @@
+'''Code relating to profiling the hot path of Agent.play. A PlayProfiler
+passed to play or train times every call of the phases of a move and keeps
+counters per phase: the number of calls, the total time and a histogram of
+the call times. Every Nth game it can also run cProfile or trace every call.
+Without a profiler play calls the phases directly, so profiling costs
+nothing when it is off.'''
+import cProfile
+import json
+import pstats
+import time
+
+
+# Phases of a move, in the order play calls them
+PHASES = ('chooseAction', 'do_action', 'learn', 'add_random_tile',
+          'legal_actions')
+# Number of histogram buckets. Bucket i counts the calls taking less than
+# 2**i but at least 2**(i-1) nanoseconds, the last one all longer calls.
+HISTOGRAM_BUCKETS = 40
+
+
+class PlayProfiler(object):
+    '''Collects timings of the phases of the moves of the games it is passed
+    to (see Agent.play)'''
+
+    def __init__(self, profileEvery=None, traceEvery=None):
+        '''Init the profiler
+        input:
+            profileEvery: Run cProfile during every profileEvery-th game,
+                          starting with the first. If None never.
+            traceEvery: Record the start and duration of every call during
+                        every traceEvery-th game, starting with the first.
+                        If None never.'''
+        self.profileEvery = profileEvery
+        self.traceEvery = traceEvery
+        self.reset()
+
+    def reset(self):
+        '''Forget everything measured so far'''
+        self.games = 0
+        # Number of calls and nanoseconds spent in every phase
+        self._counters = {phase: [0, 0] for phase in PHASES}
+        self._histograms = {phase: [0]*HISTOGRAM_BUCKETS for phase in PHASES}
+        self.traces = []
+        self._stats = None
+        self._profile = None
+        self._trace = None
+        self._gameStart = 0
+
+    def wrap(self, phase, function):
+        '''Return function timed as phase'''
+        counter = self._counters[phase]
+        histogram = self._histograms[phase]
+        last = HISTOGRAM_BUCKETS - 1
+        clock = time.perf_counter_ns
+
+        def timed(*args):
+            start = clock()
+            result = function(*args)
+            elapsed = clock() - start
+            counter[0] += 1
+            counter[1] += elapsed
+            histogram[min(elapsed.bit_length(), last)] += 1
+            if self._trace is not None:
+                self._trace.append((phase, start - self._gameStart, elapsed))
+            return result
+        return timed
+
+    def startGame(self):
+        '''Start profiling or tracing if the next game is sampled'''
+        if self._profile is not None:
+            # The last game ended without endGame
+            self._profile.disable()
+            self._profile = None
+        self._trace = None
+        if self.traceEvery is not None and self.games % self.traceEvery == 0:
+            self._trace = []
+            self._gameStart = time.perf_counter_ns()
+        if self.profileEvery is not None and \
+                self.games % self.profileEvery == 0:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def endGame(self):
+        '''Finish the game started with startGame'''
+        if self._profile is not None:
+            self._profile.disable()
+            if self._stats is None:
+                self._stats = pstats.Stats(self._profile)
+            else:
+                self._stats.add(self._profile)
+            self._profile = None
+        if self._trace is not None:
+            self.traces.append({'game': self.games, 'calls': self._trace})
+            self._trace = None
+        self.games += 1
+
+    def profileStats(self):
+        '''Return pstats.Stats of all profiled games, or None if no game was
+        profiled'''
+        return self._stats
+
+    def toDict(self):
+        '''Return the measurements as a JSON serializable dictionary: the
+        number of games and, for every phase, the number of calls, the total
+        and mean nanoseconds and the histogram as [upper bound in ns, calls]
+        pairs of the buckets holding calls, followed by the traces'''
+        phases = {}
+        for phase in PHASES:
+            calls, totalNs = self._counters[phase]
+            histogram = self._histograms[phase]
+            phases[phase] = {
+                'calls': calls, 'total_ns': totalNs,
+                'mean_ns': totalNs/calls if calls else 0.0,
+                'histogram': [[2**bucket if bucket < len(histogram) - 1
+                               else None, count]
+                              for bucket, count in enumerate(histogram)
+                              if count]}
+        return {'games': self.games, 'phases': phases,
+                'traces': [{'game': trace['game'],
+                            'calls': [list(call) for call in trace['calls']]}
+                           for trace in self.traces]}
+
+    def save(self, fileName, profileFile=None):
+        '''Write the measurements to a JSON file (see toDict)
+        input:
+            fileName: JSON file to write
+            profileFile: File to dump the cProfile statistics to, readable
+                         with pstats. If None they are not written.'''
+        with open(fileName, 'w') as jsonFile:
+            json.dump(self.toDict(), jsonFile, indent=2)
+        if profileFile is not None and self._stats is not None:
+            self._stats.dump_stats(profileFile)
+
+    def report(self):
+        '''Return a table of the time spent in every phase'''
+        total = max(sum(totalNs for _, totalNs in self._counters.values()), 1)
+        lines = ['{:<16} {:>10} {:>12} {:>10} {:>7}'.format(
+            'phase', 'calls', 'total ms', 'mean us', 'share')]
+        for phase in PHASES:
+            calls, totalNs = self._counters[phase]
+            lines.append('{:<16} {:>10} {:>12.1f} {:>10.2f} {:>6.1f}%'.format(
+                phase, calls, totalNs/1e6, totalNs/max(calls, 1)/1e3,
+                100*totalNs/total))
+        return '\n'.join(lines)
@@ -0,0 +1,339 @@
+'''Code relating to drawing games and plotting training progress. OpenCV,
+imageio and matplotlib are only needed here, so this module is imported
+lazily by the agents and importing rl2048player does not load them.'''
+import cv2
+import imageio
+import matplotlib.pyplot as plt
+import multiprocessing
+import numpy
+from PIL import Image
+
+
+# Colors of the grid and of the tiles by ln2 value
+_BACKGROUND_COLOR = (146, 135, 125)
+_COLORS = {0:(158, 148, 138), 1:(238, 228, 218), 2:(237, 224, 200),
+           3:(242, 177, 121), 4:(245, 149, 99), 5:(246, 124, 95), 
+           6:(246, 94, 59), 7:(237, 207, 114), 8:(237, 204, 97), 
+           9:(237, 200, 80), 10:(237, 197, 63), 11:(237, 197, 63), 
+           12:(62, 237, 193), 13:(62, 237, 193), 14:(62,64,237), 
+           15:(140,62,237)}
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def _drawScore(img, score, graphic_size, top_margin):
+    '''Write score at top of image'''
+    text = 'The score is ' + str(score)
+    textsize = cv2.getTextSize(text, _FONT, 0.5, 1)[0]
+    cv2.putText(img,text,(int((graphic_size-textsize[0])/2),
+                          int((3*top_margin/4+textsize[1])/2)),
+                _FONT,0.5,(0,0,0),1,cv2.LINE_AA)
+
+
+def _drawBoard(img, state, board_size, graphic_size, top_margin,
+               seperator_width):
+    '''Draw tiles and grid of a board state onto image'''
+    # Define spacing of tiles
+    spacing = int((graphic_size-seperator_width)/board_size)
+    # Draw squares
+    for i in range(board_size):
+        for k in range(board_size):
+            cv2.rectangle(img,
+                          (int(seperator_width/2)+k*spacing,
+                           int(top_margin+seperator_width/2)+i*spacing),
+                          (int(seperator_width/2)+(k+1)*spacing,
+                           int(top_margin+seperator_width/2)+(i+1)*spacing),
+                          _COLORS[state[i][k]], -1)
+            if state[i][k] == 0:
+                text = ''
+            else:
+                text = str(2**state[i][k])
+            textsize = cv2.getTextSize(text, _FONT, 0.5, 2)[0]
+            cv2.putText(img,text,
+                        (int(seperator_width/2+k*spacing+(spacing-textsize[0])/2),
+                         int(top_margin+seperator_width/2+i*spacing+(spacing+textsize[1])/2)),
+                        _FONT,0.5,(0,0,0),2,cv2.LINE_AA)
+            cv2.putText(img,text,(int(seperator_width/2+k*spacing+(spacing-textsize[0])/2),
+                                  int(top_margin+seperator_width/2+i*spacing+(spacing+textsize[1])/2)),
+                        _FONT,0.5,(255,255,255),1,cv2.LINE_AA)
+    # Draw outline grid
+    for i in range(board_size + 1):
+        cv2.line(img, 
+                (int(seperator_width/2)+i*spacing,int(top_margin+seperator_width/2)),
+                (int(seperator_width/2)+i*spacing,int(graphic_size+top_margin-seperator_width/2)), 
+                 _BACKGROUND_COLOR, seperator_width)
+    for i in range(board_size + 1):
+        cv2.line(img,
+                 (int(seperator_width/2),int(top_margin+seperator_width/2)+i*spacing),
+                 (int(graphic_size-seperator_width/2),int(top_margin+seperator_width/2)+i*spacing),
+                 _BACKGROUND_COLOR,seperator_width)
+
+
+def makeImage(score, state, board_size=4, graphic_size=750, top_margin=40,
+              seperator_width=12):
+    '''Construct the image for a game state by drawing every tile. Renderer
+    is much faster for many images.
+    input:
+        score: Score of the game
+        state: Board state
+        board_size: Number of tiles in one side of board
+        graphic_size: Size of graphic
+        top_margin: Size of top margin
+        seperator_width: Seperation between tiles in graphic
+    output: Image for a game state'''
+    img = numpy.full((graphic_size + top_margin, graphic_size, 3), 255,
+                     numpy.uint8)
+    _drawScore(img, score, graphic_size, top_margin)
+    _drawBoard(img, state, board_size, graphic_size, top_margin,
+               seperator_width)
+    return img
+
+
+class Renderer(object):
+    '''Renders game states into images like makeImage. Every tile value is
+    drawn once into a sprite of one grid cell, images are then composed by
+    copying the sprites into an empty board with numpy. Numbers too wide for
+    their tile are cut off at the tile border. For gifs the sprites are also
+    kept as indices into one shared 256 color palette, so frames need no
+    quantization of their own.'''
+
+    def __init__(self, board_size=4, graphic_size=750, top_margin=40,
+                 seperator_width=12):
+        '''Draw the empty board and the sprites
+        input:
+            board_size: Number of tiles in one side of board
+            graphic_size: Size of graphic
+            top_margin: Size of top margin
+            seperator_width: Seperation between tiles in graphic'''
+        self.board_size = board_size
+        self.graphic_size = graphic_size
+        self.top_margin = top_margin
+        spacing = int((graphic_size-seperator_width)/board_size)
+        self._spacing = spacing
+        # Top left corner of the first cell
+        self._x = int(seperator_width/2)
+        self._y = int(top_margin+seperator_width/2)
+        shape = (graphic_size + top_margin, graphic_size, 3)
+        state = numpy.zeros((board_size, board_size), dtype=numpy.int64)
+        self._empty = numpy.full(shape, 255, numpy.uint8)
+        _drawBoard(self._empty, state, board_size, graphic_size, top_margin,
+                   seperator_width)
+        # Draw every value into a cell away from the border and cut it out
+        cell = min(1, board_size - 1)
+        x = self._x + cell*spacing
+        y = self._y + cell*spacing
+        self._sprites = numpy.zeros((len(_COLORS), spacing, spacing, 3),
+                                    numpy.uint8)
+        for value in _COLORS:
+            img = numpy.full(shape, 255, numpy.uint8)
+            state[cell, cell] = value
+            _drawBoard(img, state, board_size, graphic_size, top_margin,
+                       seperator_width)
+            self._sprites[value] = img[y:y + spacing, x:x + spacing]
+        self._buildPalette()
+
+    def _buildPalette(self):
+        '''Quantize every color the images can contain (the empty board, the
+        sprites and the gray levels of the score text) to one palette'''
+        grays = numpy.repeat(numpy.arange(256, dtype=numpy.uint8)[:, None],
+                             3, axis=1)
+        colors = numpy.concatenate([self._empty.reshape(-1, 3),
+                                    self._sprites.reshape(-1, 3), grays])
+        # Colors packed into 24 bit integers, sorted for searchsorted
+        self._colorKeys, first = numpy.unique(_packColors(colors),
+                                              return_index=True)
+        if len(self._colorKeys) <= 256:
+            self._colorIndices = numpy.arange(len(self._colorKeys),
+                                              dtype=numpy.uint8)
+            palette = colors[first]
+        else:
+            # Quantize all pixels, so frequent colors are kept exactly
+            quantized = Image.fromarray(colors[None]).quantize(256)
+            self._colorIndices = numpy.asarray(quantized)[0][first]
+            palette = numpy.array(quantized.getpalette()[:3*256],
+                                  dtype=numpy.uint8).reshape(-1, 3)
+        self.palette = palette.reshape(-1).tolist()
+        self._emptyIndexed = self._toIndices(self._empty)
+        self._spritesIndexed = self._toIndices(self._sprites)
+
+    def _toIndices(self, image):
+        '''Return palette indices of an image whose colors are all known'''
+        keys = numpy.searchsorted(self._colorKeys, _packColors(image))
+        return self._colorIndices[keys]
+
+    def renderBoards(self, states):
+        '''Render the boards of many states without scores
+        input:
+            states: (N, board_size, board_size) array of states
+        output: (N, height, width, 3) array of images'''
+        states = numpy.asarray(states)
+        spacing = self._spacing
+        images = numpy.empty((len(states),) + self._empty.shape, numpy.uint8)
+        images[...] = self._empty
+        # Copying sprites slice by slice is faster than gathering them
+        for image, state in zip(images, states.tolist()):
+            for i, row in enumerate(state):
+                y = self._y + i*spacing
+                for k, value in enumerate(row):
+                    x = self._x + k*spacing
+                    image[y:y + spacing, x:x + spacing] = self._sprites[value]
+        return images
+
+    def render(self, score, state):
+        '''Render the image of one game state, same output as makeImage'''
+        return self.renderFrames([score], [state])[0]
+
+    def renderFrames(self, scores, states):
+        '''Render the images of many game states
+        input:
+            scores: (N,) scores
+            states: (N, board_size, board_size) array of states
+        output: (N, height, width, 3) array of images'''
+        images = self.renderBoards(states)
+        for image, score in zip(images, scores):
+            _drawScore(image, score, self.graphic_size, self.top_margin)
+        return images
+
+    def frames(self, log, end_pause=0, dedup=False, chunk_size=64):
+        '''Generate the images of a game chunk_size states at a time
+        input:
+            log: Log of game states and scores returned by play(verbose=True)
+            end_pause: How many times to repeat the last image
+            dedup: If true skip states equal to the state and score before
+            chunk_size: Number of images rendered at once
+        output: Generator of images'''
+        scores = numpy.array([entry[0] for entry in log])
+        states = numpy.array([entry[1] for entry in log])
+        if dedup and len(log) > 1:
+            keep = numpy.ones(len(log), dtype=bool)
+            keep[1:] = (scores[1:] != scores[:-1]) | numpy.any(
+                states[1:] != states[:-1], axis=(1, 2))
+            scores, states = scores[keep], states[keep]
+        image = None
+        for start in range(0, len(states), chunk_size):
+            for image in self.renderFrames(scores[start:start + chunk_size],
+                                           states[start:start + chunk_size]):
+                yield image
+        # Pause on last image
+        if image is not None:
+            for _ in range(end_pause):
+                yield image
+
+    def indexedFrames(self, log, end_pause=0, dedup=False):
+        '''Generate the images of a game as (height, width) arrays of indices
+        into palette. Same options as frames.'''
+        scores = [entry[0] for entry in log]
+        states = numpy.array([entry[1] for entry in log])
+        image = None
+        previous = None
+        for score, state in zip(scores, states.tolist()):
+            if dedup and previous == (score, state):
+                continue
+            previous = (score, state)
+            image = self._emptyIndexed.copy()
+            spacing = self._spacing
+            for i, row in enumerate(state):
+                y = self._y + i*spacing
+                for k, value in enumerate(row):
+                    x = self._x + k*spacing
+                    image[y:y + spacing, x:x + spacing] = \
+                        self._spritesIndexed[value]
+            # Draw the score onto the top margin and look up its colors
+            margin = self._empty[:self.top_margin].copy()
+            _drawScore(margin, score, self.graphic_size, self.top_margin)
+            image[:self.top_margin] = self._toIndices(margin)
+            yield image
+        # Pause on last image
+        if image is not None:
+            for _ in range(end_pause):
+                yield image
+
+
+def _packColors(image):
+    '''Pack the RGB colors of an image into 24 bit integers'''
+    image = numpy.asarray(image, dtype=numpy.uint32)
+    return (image[..., 0] << 16) | (image[..., 1] << 8) | image[..., 2]
+
+
+def writeGif(gif_file, log, board_size=4, graphic_size=750, top_margin=40,
+             seperator_width=12, end_pause=50, dedup=False, renderer=None,
+             duration=100):
+    '''Write gif (or any format imageio can write, e.g. a video) of a game.
+    Frames are rendered one after another and streamed to the writer. Gifs
+    are written by Pillow from palette frames, identical consecutive frames
+    are merged into one longer frame.
+    input:
+        gif_file: File to save gif
+        log: Log of game states and scores returned by play(verbose=True)
+        board_size: Number of tiles in one side of board
+        graphic_size: Size of graphic
+        top_margin: Size of top margin
+        seperator_width: Seperation between tiles in graphic
+        end_pause: How many frame to pause at end of gif
+        dedup: If true skip frames equal to the frame before
+        renderer: Renderer to use. If None make one with the sizes above.
+        duration: Milliseconds per frame of a gif'''
+    if renderer is None:
+        renderer = Renderer(board_size, graphic_size, top_margin,
+                            seperator_width)
+    if str(gif_file).lower().endswith('.gif'):
+        images = (Image.fromarray(image, 'P') for image in
+                  renderer.indexedFrames(log, end_pause, dedup))
+        first = next(images, None)
+        if first is None:
+            return
+        first.putpalette(renderer.palette)
+        # Pillow pulls the remaining frames from the generator while saving
+        first.save(gif_file, save_all=True, append_images=_withPalette(
+            images, renderer.palette), duration=duration, loop=0,
+            optimize=False)
+        return
+    with imageio.get_writer(gif_file, mode='I') as writer:
+        for image in renderer.frames(log, end_pause, dedup):
+            writer.append_data(image)
+
+
+def _withPalette(images, palette):
+    '''Set the palette of every image of a generator'''
+    for image in images:
+        image.putpalette(palette)
+        yield image
+
+
+def _writeGifJob(job):
+    '''Write one gif of writeGifs'''
+    gif_file, log, kwargs = job
+    writeGif(gif_file, log, **kwargs)
+    return gif_file
+
+
+def writeGifs(gif_files, logs, workers=None, **kwargs):
+    '''Write gifs of many games, encoding them in several processes
+    input:
+        gif_files: Files to save the gifs
+        logs: Logs of games returned by play(verbose=True)
+        workers: Number of worker processes. If None use one per core.
+        kwargs: Further options of writeGif
+    output: List of written files'''
+    jobs = [(gif_file, log, kwargs) for gif_file, log in zip(gif_files, logs)]
+    if workers == 1 or len(jobs) <= 1:
+        return [_writeGifJob(job) for job in jobs]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(_writeGifJob, jobs)
+
+
+def plotScores(x, rollingAverages, label, graphFile=None):
+    '''Plot rolling averages of scores over training
+    input:
+        x: Trials at the center of every window
+        rollingAverages: Rolling averages of the scores
+        label: Label for graph
+        graphFile: File to write graph to. Does not save graph if is None.'''
+    # Plot rollingAverages versus x
+    plt.plot(x, rollingAverages, label=label)
+    # Label axes
+    plt.xlabel('Trial')
+    plt.ylabel('Score')
+    # Save graph
+    if graphFile is not None:
+        plt.savefig(graphFile)
+        plt.clf()
@@ -0,0 +1,277 @@
+'''Code relating to recording games so they can be replayed. A replay file
+holds one fixed size step per move: the packed board before the move (see
+bitboard), the action taken and a byte describing the tile spawned after it.
+Every game ends with a step holding its final board and NO_ACTION. The games
+are appended to the file and an index file next to it records where every
+game starts, how many moves it has and its final score. Readers memory map
+the file, so games are read back as numpy arrays without creating Python
+objects per move.'''
+import numpy
+import os
+from .batch import moveBoards, unpackBoards
+from .rng import makeGenerator
+
+
+# Step of a game
+STEP_DTYPE = numpy.dtype([('board', '<u8'), ('action', 'u1'),
+                          ('spawn', 'u1')])
+# Entry of the index, one per game
+INDEX_DTYPE = numpy.dtype([('start', '<i8'), ('moves', '<i4'),
+                           ('score', '<i8')])
+# Transition between two steps, as returned by ReplayReader.transitions
+TRANSITION_DTYPE = numpy.dtype([('board', '<u8'), ('action', 'u1'),
+                                ('reward', '<i8'), ('afterstate', '<u8'),
+                                ('next_board', '<u8'), ('final', '?'),
+                                ('prev_state', '<u8')])
+# Action of the last step of a game
+NO_ACTION = 255
+# First bytes of a replay file and of its index
+MAGIC = b'RL2048R\n'
+INDEX_MAGIC = b'RL2048I\n'
+
+
+def indexFile(fileName):
+    '''Return the index file of a replay file'''
+    return fileName + '.idx'
+
+
+def spawnByte(board, spawned):
+    '''Return the byte describing the tile spawned on a board
+    input:
+        board: Packed board before the tile was spawned
+        spawned: Packed board after the tile was spawned
+    output: Cell of the tile (row*4 + col) times 16 plus its ln2 value'''
+    diff = spawned ^ board
+    shift = (diff.bit_length() - 1) & ~3
+    return ((60 - shift) << 2) | (diff >> shift)
+
+
+def decodeSpawns(spawns):
+    '''Decode an array of spawn bytes
+    output: Tuple of arrays of the rows, columns and ln2 values of the
+            spawned tiles'''
+    spawns = numpy.asarray(spawns)
+    return spawns >> 6, (spawns >> 4) & 3, spawns & 0xF
+
+
+class ReplayWriter(object):
+    '''Appends games to a replay file. Steps are buffered and written
+    bufferSize at a time, the index entry of a game is written after all its
+    steps, so a crash never leaves an indexed game incomplete.'''
+
+    def __init__(self, fileName, mode='w', bufferSize=2**16):
+        '''Initialize the writer
+        input:
+            fileName: Replay file to write to
+            mode: 'w' to overwrite or 'a' to append to the file
+            bufferSize: Number of steps buffered before they are written'''
+        self.fileName = fileName
+        append = mode.startswith('a') and os.path.exists(fileName) and \
+            os.path.getsize(fileName) > 0
+        if append:
+            index = readIndex(fileName)
+            # Drop steps of a game that was not finished
+            self._steps = 0
+            if len(index):
+                self._steps = int(index['start'][-1] + index['moves'][-1] + 1)
+            self._file = open(fileName, 'r+b')
+            self._file.truncate(len(MAGIC) + self._steps*STEP_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+            self._indexFile = open(indexFile(fileName), 'ab')
+        else:
+            self._steps = 0
+            self._file = open(fileName, 'wb')
+            self._file.write(MAGIC)
+            self._indexFile = open(indexFile(fileName), 'wb')
+            self._indexFile.write(INDEX_MAGIC)
+        # Step the current game started at
+        self._gameStart = self._steps
+        self._buffer = numpy.zeros(bufferSize, dtype=STEP_DTYPE)
+        self._count = 0
+        self._index = []
+
+    def record(self, board, action, spawn):
+        '''Record a move of the current game
+        input:
+            board: Packed board before the move
+            action: Action taken
+            spawn: Tile spawned after the move (see spawnByte)'''
+        if self._count == len(self._buffer):
+            self._writeSteps()
+        self._buffer[self._count] = (board, action, spawn)
+        self._count += 1
+
+    def endGame(self, board, score):
+        '''Finish the current game
+        input:
+            board: Final packed board
+            score: Final score'''
+        self.record(board, NO_ACTION, 0)
+        self._finishGame(score)
+
+    def recordGame(self, boards, actions, spawns, score):
+        '''Record a whole game at once
+        input:
+            boards: Array of the packed boards before every move followed by
+                    the final board
+            actions: Array of the actions taken
+            spawns: Array of the tiles spawned after every move
+            score: Final score'''
+        steps = numpy.zeros(len(boards), dtype=STEP_DTYPE)
+        steps['board'] = boards
+        steps['action'][:-1] = actions
+        steps['action'][-1] = NO_ACTION
+        steps['spawn'][:-1] = spawns
+        self._writeSteps()
+        self._file.write(steps.tobytes())
+        self._steps += len(steps)
+        self._finishGame(score)
+
+    def _finishGame(self, score):
+        '''Add the index entry of the current game'''
+        moves = self._steps + self._count - self._gameStart - 1
+        self._index.append((self._gameStart, moves, score))
+        self._gameStart = self._steps + self._count
+        if self._count > len(self._buffer)//2:
+            self.flush()
+
+    def _writeSteps(self):
+        '''Write the buffered steps'''
+        if self._count:
+            self._file.write(self._buffer[:self._count].tobytes())
+            self._steps += self._count
+            self._count = 0
+
+    def flush(self):
+        '''Write the buffered steps and the index of the finished games'''
+        self._writeSteps()
+        self._file.flush()
+        if self._index:
+            self._indexFile.write(numpy.array(self._index,
+                                              dtype=INDEX_DTYPE).tobytes())
+            self._indexFile.flush()
+            self._index = []
+
+    def close(self):
+        '''Flush and close the writer. Steps of an unfinished game are
+        dropped when the file is appended to.'''
+        self.flush()
+        self._file.close()
+        self._indexFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readIndex(fileName):
+    '''Read the index of a replay file
+    output: Structured array of INDEX_DTYPE with one entry per game'''
+    with open(indexFile(fileName), 'rb') as indexData:
+        if indexData.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(indexFile(fileName) + ' is not a replay index')
+        return numpy.fromfile(indexData, dtype=INDEX_DTYPE)
+
+
+class ReplayReader(object):
+    '''Reads a replay file. The steps are memory mapped and games are
+    returned as views of them.'''
+
+    def __init__(self, fileName):
+        '''Open a replay file
+        input:
+            fileName: Replay file written by ReplayWriter'''
+        with open(fileName, 'rb') as replayFile:
+            if replayFile.read(len(MAGIC)) != MAGIC:
+                raise ValueError(fileName + ' is not a replay file')
+        self.index = readIndex(fileName)
+        numSteps = (os.path.getsize(fileName) - len(MAGIC)) // \
+            STEP_DTYPE.itemsize
+        if numSteps:
+            self.steps = numpy.memmap(fileName, dtype=STEP_DTYPE, mode='r',
+                                      offset=len(MAGIC), shape=(numSteps,))
+        else:
+            self.steps = numpy.zeros(0, dtype=STEP_DTYPE)
+
+    def __len__(self):
+        '''Return the number of games'''
+        return len(self.index)
+
+    def __getitem__(self, game):
+        '''Return the steps of a game (see STEP_DTYPE)'''
+        start, moves, _ = self.index[game]
+        return self.steps[start:start + moves + 1]
+
+    def __iter__(self):
+        '''Iterate over the steps of every game'''
+        for game in range(len(self)):
+            yield self[game]
+
+    def states(self, game):
+        '''Return (moves + 1, 4, 4) array of the states of a game'''
+        return unpackBoards(self[game]['board'])
+
+    def scores(self, game):
+        '''Return array of the score of a game before every move and at its
+        end'''
+        steps = self[game]
+        rewards = self._rewards(steps['board'][:-1], steps['action'][:-1])
+        return numpy.concatenate([[0], numpy.cumsum(rewards)])
+
+    def log(self, game):
+        '''Return the log of a game in the format of play(verbose=True), e.g.
+        for rendering.writeGif'''
+        return [list(entry) for entry in zip(self.scores(game),
+                                             self.states(game))]
+
+    @staticmethod
+    def _rewards(boards, actions, afterstates=False):
+        '''Return the rewards (and afterstates) of moves'''
+        results, rewards = moveBoards(boards)
+        which = numpy.arange(len(actions))
+        if afterstates:
+            return rewards[actions, which], results[actions, which]
+        return rewards[actions, which]
+
+    def transitions(self, chunkSize=2**16, rng=None):
+        '''Iterate over the moves of all games in chunks
+        input:
+            chunkSize: Number of steps read per chunk
+            rng: numpy.random.Generator or seed to visit the chunks in random
+                 order with. If None visit them in order.
+        output: Generator of structured arrays of TRANSITION_DTYPE. final is
+                true for the last move of every game. prev_state is the state
+                play passes to learn as prevState for the move: the
+                afterstate of the move before, or the board for the first
+                move of a game.'''
+        end = int(self.index['start'][-1] + self.index['moves'][-1] + 1) \
+            if len(self) else 0
+        starts = numpy.arange(0, max(end - 1, 0), chunkSize)
+        if rng is not None:
+            starts = makeGenerator(rng).permutation(starts)
+        for start in starts:
+            # One step before the chunk for the move before its first move
+            # and one step after it for the board after its last move
+            first = max(start - 1, 0)
+            steps = numpy.array(self.steps[first:min(start + chunkSize + 1,
+                                                     end)])
+            moves = numpy.flatnonzero(steps['action'][:-1] != NO_ACTION)
+            moves = moves[moves >= start - first]
+            transitions = numpy.zeros(len(moves), dtype=TRANSITION_DTYPE)
+            transitions['board'] = steps['board'][moves]
+            transitions['action'] = steps['action'][moves]
+            transitions['reward'], transitions['afterstate'] = self._rewards(
+                transitions['board'], transitions['action'], True)
+            transitions['next_board'] = steps['board'][moves + 1]
+            transitions['final'] = steps['action'][moves + 1] == NO_ACTION
+            # Moves following a move of the same game learn from its
+            # afterstate
+            follows = moves > 0
+            follows[follows] = steps['action'][moves[follows] - 1] != NO_ACTION
+            transitions['prev_state'] = transitions['board']
+            transitions['prev_state'][follows] = self._rewards(
+                steps['board'][moves[follows] - 1],
+                steps['action'][moves[follows] - 1], True)[1]
+            yield transitions
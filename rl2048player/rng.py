@@ -0,0 +1,106 @@
+'''Code relating to the random numbers used by games, agents and trainers.
+   Everything random draws from an explicit numpy.random.Generator, so a run
+   can be reproduced from its seed. Scalar draws are served from a buffer
+   filled in bulk, because drawing single numbers from a Generator is slow.'''
+import numpy
+
+
+def makeGenerator(rng=None):
+    '''Return a numpy.random.Generator
+    input:
+        rng: Generator (returned as is), RandomBuffer (its generator), seed or
+             None for a generator seeded from the operating system'''
+    if isinstance(rng, numpy.random.Generator):
+        return rng
+    if isinstance(rng, RandomBuffer):
+        return rng.generator
+    return numpy.random.default_rng(rng)
+
+
+def makeRandom(rng=None):
+    '''Return a RandomBuffer
+    input:
+        rng: RandomBuffer (returned as is), Generator, seed or None'''
+    if isinstance(rng, RandomBuffer):
+        return rng
+    return RandomBuffer(rng)
+
+
+class RandomBuffer(object):
+    '''Hands out uniform random numbers in [0, 1) that are drawn from a
+    Generator size at a time. The generator is only created when the first
+    number is needed, so unused buffers are cheap.'''
+
+    def __init__(self, rng=None, size=4096):
+        '''Init the buffer
+        input:
+            rng: Generator, seed or None for a generator seeded from the
+                 operating system
+            size: Number of values drawn at once'''
+        self._rng = rng
+        self._generator = None
+        self.size = size
+        self._array = numpy.zeros(0)
+        self._list = []
+        self._index = 0
+        # State of the generator before the buffer was filled
+        self._fillState = None
+
+    @property
+    def generator(self):
+        '''Return the numpy.random.Generator the buffer draws from'''
+        if self._generator is None:
+            self._generator = makeGenerator(self._rng)
+            self._rng = None
+        return self._generator
+
+    def _refill(self):
+        '''Draw the next size values'''
+        self._fillState = self.generator.bit_generator.state
+        self._array = self.generator.random(self.size)
+        self._list = self._array.tolist()
+        self._index = 0
+
+    def random(self):
+        '''Return a random float in [0, 1)'''
+        if self._index == len(self._list):
+            self._refill()
+        value = self._list[self._index]
+        self._index += 1
+        return value
+
+    def randrange(self, n):
+        '''Return a random int in [0, n)'''
+        return int(self.random()*n)
+
+    def randoms(self, n):
+        '''Return array of n random floats in [0, 1)'''
+        if n > self.size:
+            return self.generator.random(n)
+        if self._index + n > len(self._list):
+            self._refill()
+        values = self._array[self._index:self._index + n]
+        self._index += n
+        return values
+
+    def getState(self):
+        '''Return the state of the buffer and its generator as a JSON
+        serializable dictionary. Instead of the buffered values it holds the
+        generator state they were drawn from.'''
+        return {'generator': self.generator.bit_generator.state,
+                'fill': self._fillState, 'size': self.size,
+                'index': self._index}
+
+    def setState(self, state):
+        '''Restore a state returned by getState'''
+        self.size = state['size']
+        if state['fill'] is None:
+            self._array = numpy.zeros(0)
+            self._list = []
+            self._fillState = None
+        else:
+            # Draw the buffered values again
+            self.generator.bit_generator.state = state['fill']
+            self._refill()
+        self._index = state['index']
+        self.generator.bit_generator.state = state['generator']
@@ -0,0 +1,219 @@
+'''Code relating to playing with a depth limited expectimax search on top of a
+trained TD0Agent. The agent's look up table gives the value of the
+afterstates at the leaves of the search.'''
+import collections
+import numpy
+import time
+from .batch import unpackBoards
+from .bitboard import BitGame, ROW_EMPTY, ROW_MASK, afterstates
+from .rng import makeRandom
+
+
+# Values and probabilities of the tiles added after every move
+_SPAWNS = ((1, 0.9), (2, 0.1))
+
+
+class _BudgetExceeded(Exception):
+    '''Raised when a search runs out of nodes or time'''
+    pass
+
+
+class SearchPlayer(object):
+    '''Plays 2048 by running an expectimax search over the random tiles before
+    every move. Searches deepen iteratively until depth is reached or the
+    node or time budget of the move runs out, the action of the deepest
+    completed search is played.'''
+
+    def __init__(self, agent, depth=2, minProbability=1e-4, maxNodes=None,
+                 timeLimit=None, cacheSize=2**16, rng=None):
+        '''Initialize the player
+        input:
+            agent: Trained TD0Agent whose table values the leaves
+            depth: Largest number of moves to look ahead
+            minProbability: Chance nodes reached with a smaller probability
+                            are valued by the table instead of searched
+            maxNodes: Largest number of nodes searched per move. If None no
+                      limit.
+            timeLimit: Largest number of seconds searched per move. If None
+                       no limit.
+            cacheSize: Number of entries in the transposition table
+            rng: numpy.random.Generator or seed of the games played'''
+        self.agent = agent
+        self.depth = depth
+        self.minProbability = minProbability
+        self.maxNodes = maxNodes
+        self.timeLimit = timeLimit
+        self.cacheSize = cacheSize
+        self._random = makeRandom(rng)
+        # Transposition table mapping (board, depth) to the value of the
+        # chance node, least recently used entries first. Only values of
+        # chance nodes searched without pruning are stored, the others depend
+        # on the probability they were reached with.
+        self._cache = collections.OrderedDict()
+        self.nodes = 0
+        self.moves = 0
+        self.searchTime = 0
+        # Nodes searched and deadline of the current move
+        self._nodes = 0
+        self._deadline = None
+        # Number of nodes valued by the table for their low probability
+        self._pruned = 0
+
+    def _lookUpCache(self, key):
+        '''Return cached value of key, or None'''
+        value = self._cache.get(key)
+        if value is not None:
+            self._cache.move_to_end(key)
+        return value
+
+    def _storeCache(self, key, value):
+        '''Store value of key, evicting the least recently used entry'''
+        self._cache[key] = value
+        if len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+    def _countNode(self):
+        '''Count a searched node and stop the search if the budget is spent'''
+        self._nodes += 1
+        if self.maxNodes is not None and self._nodes > self.maxNodes:
+            raise _BudgetExceeded()
+        if (self._deadline is not None and self._nodes % 256 == 0 and
+                time.perf_counter() > self._deadline):
+            raise _BudgetExceeded()
+
+    def _leafValues(self, boards):
+        '''Value afterstates with the agent's table
+        input:
+            boards: List of packed afterstates
+        output: List of values'''
+        values = [self._lookUpCache((board, 0)) for board in boards]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            # Evaluate all missing afterstates with one look up
+            evaluated = self.agent.mask.evaluate(
+                self.agent.tuples, unpackBoards(numpy.array(
+                    [boards[i] for i in missing], dtype=numpy.uint64)))
+            for i, value in zip(missing, evaluated):
+                values[i] = float(value)
+                self._storeCache((boards[i], 0), values[i])
+        return values
+
+    def _greedyValues(self, board):
+        '''Value every available action of a board by the agent's table
+        alone
+        input:
+            board: Packed board
+        output: Dictionary mapping available actions to values'''
+        boards, rewards, available = afterstates(board)
+        actions = [action for action in range(4) if available[action]]
+        values = self._leafValues([boards[action] for action in actions])
+        return {action: rewards[action] + value
+                for action, value in zip(actions, values)}
+
+    def _actionValues(self, board, depth, probability):
+        '''Value every available action of a board where a move is next
+        input:
+            board: Packed board
+            depth: Number of moves left to search after this one
+            probability: Probability of reaching this board
+        output: Dictionary mapping available actions to values'''
+        self._countNode()
+        if depth == 0:
+            return self._greedyValues(board)
+        if probability < self.minProbability:
+            self._pruned += 1
+            return self._greedyValues(board)
+        boards, rewards, available = afterstates(board)
+        actions = [action for action in range(4) if available[action]]
+        values = [self._chanceValue(boards[action], depth, probability)
+                  for action in actions]
+        return {action: rewards[action] + value
+                for action, value in zip(actions, values)}
+
+    def _chanceValue(self, board, depth, probability):
+        '''Expected value of an afterstate over the random tile added to it
+        input:
+            board: Packed afterstate
+            depth: Number of moves left to search
+            probability: Probability of reaching this afterstate
+        output: Expected value'''
+        value = self._lookUpCache((board, depth))
+        if value is not None:
+            return value
+        self._countNode()
+        pruned = self._pruned
+        empty = [60 - 16*row - 4*col for row in range(4) for col in
+                 ROW_EMPTY[(board >> (48 - 16*row)) & ROW_MASK]]
+        value = 0
+        for shift in empty:
+            for tile, tileProbability in _SPAWNS:
+                childProbability = probability*tileProbability/len(empty)
+                actionValues = self._actionValues(board | (tile << shift),
+                                                  depth - 1, childProbability)
+                # A board without moves ends the game and has value 0
+                if actionValues:
+                    value += tileProbability*max(actionValues.values())
+        value /= len(empty)
+        if self._pruned == pruned:
+            self._storeCache((board, depth), value)
+        return value
+
+    def chooseBoardAction(self, board):
+        '''Choose next action for a packed board
+        input:
+            board: Packed board with at least one available action
+        output: Next action to take'''
+        start = time.perf_counter()
+        self._nodes = 0
+        self._deadline = None
+        if self.timeLimit is not None:
+            self._deadline = start + self.timeLimit
+        # Depth 0 is the greedy choice of the agent
+        values = None
+        try:
+            for depth in range(self.depth + 1):
+                values = self._actionValues(board, depth, 1)
+        except _BudgetExceeded:
+            pass
+        if values is None:
+            # The budget does not even cover the greedy choice, make it
+            # without counting nodes
+            values = self._greedyValues(board)
+        self.nodes += self._nodes
+        self.moves += 1
+        self.searchTime += time.perf_counter() - start
+        return max(values, key=values.get)
+
+    def chooseAction(self, state, actions=None):
+        '''Choose next action to take, same signature as Agent.chooseAction
+        input:
+            state: Current state of game
+            actions: Possible actions to take. Unused, the search finds them.
+        output: Next action to take'''
+        return self.chooseBoardAction(BitGame(state).board())
+
+    def play(self, verbose=False):
+        '''Player plays a single game. The agent does not learn.
+        input:
+            verbose: If verbose is true also return game states and scores
+        output:
+            final score and log if verbose is set to true'''
+        game = BitGame(rng=self._random)
+        if verbose:
+            log = [[game.score(), game.state().copy()]]
+        while not game.game_over():
+            game.do_action(self.chooseBoardAction(game.board()))
+            game.add_random_tile()
+            if verbose:
+                log.append([game.score(), game.state().copy()])
+        if verbose:
+            return game.score(), log
+        return game.score()
+
+    def getStats(self):
+        '''Return dictionary with the number of moves, nodes searched per
+        move, moves per second and cache entries so far'''
+        return {'moves': self.moves,
+                'nodes_per_move': self.nodes/max(self.moves, 1),
+                'moves_per_sec': self.moves/max(self.searchTime, 1e-9),
+                'cache_entries': len(self._cache)}
@@ -0,0 +1,264 @@
+'''Code relating to the weight stores that can hold an agent's look up table.
+   A dense numpy array needs one entry for every possible tuple num, which
+   grows as (maxTile+1)**tupleLength. The stores in this module only hold
+   the entries that are visited (HashStore) or a fixed number of entries that
+   tuple nums are hashed onto (FeatureHashStore). Both are indexed like the
+   dense table: store[nums], store[nums, action], store[nums] = values.'''
+import copy
+import numpy
+import time
+from abc import ABC, abstractmethod
+
+
+# Multiplier for fibonacci hashing (2**64 divided by the golden ratio)
+_GOLDEN = numpy.uint64(0x9E3779B97F4A7C15)
+
+
+def _hash(nums, bits):
+    '''Fibonacci hash of int64 tuple nums onto bits bits'''
+    nums = numpy.asarray(nums, dtype=numpy.int64).astype(numpy.uint64)
+    with numpy.errstate(over='ignore'):
+        return ((nums * _GOLDEN) >> numpy.uint64(64 - bits)).astype(numpy.intp)
+
+
+class Store(ABC):
+    '''Abstract class identifing the functions a weight store needs'''
+
+    def __init__(self, width=None, dtype=float):
+        '''Init the store
+        input:
+            width: Number of values per tuple num (e.g. 4 for a q table). If
+                   None one value per tuple num.
+            dtype: dtype of the values'''
+        self.width = width
+        self.dtype = numpy.dtype(dtype)
+
+    def _newValues(self, size):
+        '''Return zeroed value array with room for size tuple nums'''
+        if self.width is None:
+            return numpy.zeros(size, dtype=self.dtype)
+        return numpy.zeros((size, self.width), dtype=self.dtype)
+
+    @abstractmethod
+    def _slots(self, nums, insert):
+        '''Find the slots of the value array holding tuple nums
+        input:
+            nums: Array of tuple nums
+            insert: If true give missing tuple nums a slot
+        output: Array of slots, -1 where a tuple num is missing'''
+        pass
+
+    @staticmethod
+    def _splitKey(key):
+        '''Split an index into tuple nums and the index of the remaining
+        (action) dimension'''
+        if isinstance(key, tuple):
+            return key[0], key[1:]
+        return key, ()
+
+    def __getitem__(self, key):
+        nums, rest = self._splitKey(key)
+        slots = self._slots(nums, False)
+        values = self._values[(numpy.maximum(slots, 0),) + rest]
+        # Missing tuple nums have the value zero
+        missing = slots < 0
+        if numpy.any(missing):
+            values = numpy.where(missing.reshape(missing.shape + (1,) *
+                                 (numpy.ndim(values) - missing.ndim)),
+                                 0, values)
+        return values
+
+    def __setitem__(self, key, value):
+        nums, rest = self._splitKey(key)
+        # Find the slots first, inserting may replace the value array
+        slots = self._slots(nums, True)
+        self._values[(slots,) + rest] = value
+
+    def add(self, nums, deltas):
+        '''Add deltas to the values of tuple nums. Repeated tuple nums are all
+        added, like numpy.add.at.
+        input:
+            nums: Array of tuple nums
+            deltas: Values to add, broadcastable to store[nums]'''
+        slots = self._slots(nums, True)
+        numpy.add.at(self._values, slots, deltas)
+
+    def clampMin(self, nums, minimum=0):
+        '''Raise the values of tuple nums to at least minimum'''
+        slots = self._slots(nums, True)
+        self._values[slots] = numpy.maximum(self._values[slots], minimum)
+
+    @property
+    def nbytes(self):
+        '''Return number of bytes used by the store'''
+        return self._values.nbytes
+
+
+class HashStore(Store):
+    '''Open addressing hash table (linear probing) on numpy arrays. Only
+    tuple nums that have been written take up memory. The table doubles
+    whenever it becomes more than maxLoad full.'''
+
+    _EMPTY = -1
+
+    def __init__(self, width=None, dtype=float, capacity=2**16,
+                 maxLoad=0.5):
+        '''Init the store
+        input:
+            width: Number of values per tuple num. If None one value.
+            dtype: dtype of the values
+            capacity: Initial number of slots, rounded up to a power of two
+            maxLoad: Largest fraction of used slots before the table grows'''
+        super().__init__(width, dtype)
+        self.maxLoad = maxLoad
+        self._bits = max(1, int(numpy.ceil(numpy.log2(capacity))))
+        self._keys = numpy.full(2**self._bits, self._EMPTY, dtype=numpy.int64)
+        self._values = self._newValues(2**self._bits)
+        self._count = 0
+
+    def __len__(self):
+        '''Return number of stored tuple nums'''
+        return self._count
+
+    def _slots(self, nums, insert):
+        '''Find the slots of the value array holding tuple nums
+        input:
+            nums: Array of tuple nums
+            insert: If true give missing tuple nums a slot
+        output: Array of slots, -1 where a tuple num is missing'''
+        nums = numpy.asarray(nums, dtype=numpy.int64)
+        flat = nums.reshape(-1)
+        if insert and (self._count + len(flat) >
+                       self.maxLoad * len(self._keys)):
+            self._grow(self._count + len(flat))
+        slotMask = len(self._keys) - 1
+        position = _hash(flat, self._bits)
+        slots = numpy.full(len(flat), -1, dtype=numpy.intp)
+        pending = numpy.arange(len(flat))
+        while len(pending):
+            keys = self._keys[position[pending]]
+            found = keys == flat[pending]
+            slots[pending[found]] = position[pending[found]]
+            empty = keys == self._EMPTY
+            # Probe the next slot where another num is stored
+            collided = pending[~found & ~empty]
+            position[collided] = (position[collided] + 1) & slotMask
+            if insert:
+                # Claim the empty slots. If several nums claim the same slot
+                # one of them wins and the others keep probing.
+                claim = pending[empty]
+                self._keys[position[claim]] = flat[claim]
+                self._count += len(numpy.unique(position[claim]))
+                pending = pending[~found]
+            else:
+                pending = collided
+        return slots.reshape(nums.shape)
+
+    def _grow(self, needed):
+        '''Rehash into a table big enough to hold needed tuple nums'''
+        used = self._keys != self._EMPTY
+        keys = self._keys[used]
+        values = self._values[used]
+        while needed > self.maxLoad * 2**self._bits:
+            self._bits += 1
+        self._keys = numpy.full(2**self._bits, self._EMPTY, dtype=numpy.int64)
+        self._values = self._newValues(2**self._bits)
+        self._count = 0
+        self._values[self._slots(keys, True)] = values
+
+    @property
+    def nbytes(self):
+        '''Return number of bytes used by the store'''
+        return self._keys.nbytes + self._values.nbytes
+
+
+class FeatureHashStore(Store):
+    '''Feature hashing store with a fixed memory budget. Tuple nums are
+    hashed onto budget slots, tuple nums that collide share their value.'''
+
+    def __init__(self, width=None, dtype=float, budget=2**20):
+        '''Init the store
+        input:
+            width: Number of values per tuple num. If None one value.
+            dtype: dtype of the values
+            budget: Number of slots, rounded up to a power of two'''
+        super().__init__(width, dtype)
+        self._bits = max(1, int(numpy.ceil(numpy.log2(budget))))
+        self._values = self._newValues(2**self._bits)
+
+    def __len__(self):
+        '''Return number of slots'''
+        return len(self._values)
+
+    def _slots(self, nums, insert):
+        '''Find the slots of the value array holding tuple nums
+        input:
+            nums: Array of tuple nums
+            insert: Unused, every tuple num has a slot
+        output: Array of slots'''
+        return _hash(nums, self._bits)
+
+
+def makeStore(kind, size, width=None, dtype=float):
+    '''Create a look up table
+    input:
+        kind: 'dense' for a numpy array, 'hash' for a HashStore or 'hashed' for
+              a FeatureHashStore. A Store is returned unchanged.
+        size: Number of tuple nums (mask.getMaxTupleNum()), only used by
+              dense tables
+        width: Number of values per tuple num. If None one value.
+        dtype: dtype of the values
+    output: Look up table'''
+    if isinstance(kind, Store):
+        return kind
+    if kind == 'dense':
+        if width is None:
+            return numpy.zeros(size, dtype=dtype)
+        return numpy.zeros((size, width), dtype=dtype)
+    if kind == 'hash':
+        return HashStore(width, dtype)
+    if kind == 'hashed':
+        return FeatureHashStore(width, dtype)
+    raise ValueError('Unknown store: ' + str(kind))
+
+
+def measureThroughput(store, mask, numStates=2000, repeats=5, seed=0):
+    '''Measure how fast a store looks up and updates the tuple nums of random
+    states. The updates are timed on a copy, so store is left unchanged.
+    input:
+        store: Look up table (Store or numpy array)
+        mask: Mask used to produce the tuple nums
+        numStates: Number of random states per repeat
+        repeats: Number of times to repeat the measurement
+        seed: Seed for the random states
+    output: Dictionary with lookups and updates per second (one lookup or
+            update per tuple num) and bytes used'''
+    # Time the updates on a copy, they would change the values of store
+    store = numpy.array(store) if isinstance(store, numpy.ndarray) else \
+        copy.deepcopy(store)
+    rng = numpy.random.RandomState(seed)
+    size = mask.getBoardSize()
+    states = rng.randint(0, 12, (numStates, size, size))
+    tupleNums = mask.getTupleNums(states).reshape(-1)
+    deltas = numpy.ones(len(tupleNums), dtype=float)
+    if isinstance(store, Store):
+        hasWidth = store.width is not None
+    else:
+        hasWidth = store.ndim == 2
+    if hasWidth:
+        deltas = deltas[:, None]
+    lookupTime = updateTime = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if isinstance(store, Store):
+            store.add(tupleNums, deltas)
+        else:
+            numpy.add.at(store, tupleNums, deltas)
+        lookupStart = time.perf_counter()
+        store[tupleNums]
+        end = time.perf_counter()
+        updateTime += lookupStart - start
+        lookupTime += end - lookupStart
+    return {'lookups_per_sec': repeats*len(tupleNums)/lookupTime,
+            'updates_per_sec': repeats*len(tupleNums)/updateTime,
+            'nbytes': int(store.nbytes)}
@@ -0,0 +1,273 @@
+'''Code relating to logging the games played during training. Loggers collect
+one record per game in a buffer and append it to a file whenever the buffer
+is full or flushInterval seconds have passed, so a run can be watched while
+it trains and a crash only loses the last few games. Logs are written as CSV
+or as a compact binary file of fixed size records, and are read back in
+chunks so very large logs never have to be held as Python objects.'''
+import itertools
+import numpy
+import os
+import time
+from abc import ABC, abstractmethod
+
+
+# One record per game
+RECORD_DTYPE = numpy.dtype([('score', '<i8'), ('max_tile', '<i4'),
+                            ('moves', '<i4'), ('wall_time', '<f8'),
+                            ('steps_per_sec', '<f8')])
+# First bytes of a binary log
+MAGIC = b'RL2048L\n'
+# Header line of a CSV log
+CSV_HEADER = ','.join(RECORD_DTYPE.names)
+_CSV_FORMAT = ['%d', '%d', '%d', '%.6f', '%.1f']
+
+
+def makeRecords(scores, maxTiles, moves, wallTimes):
+    '''Return structured array of records
+    input:
+        scores: Final scores of games
+        maxTiles: Largest tile of every game (e.g. 2048)
+        moves: Number of moves of every game
+        wallTimes: Seconds every game took'''
+    scores = numpy.atleast_1d(scores)
+    records = numpy.zeros(len(scores), dtype=RECORD_DTYPE)
+    records['score'] = scores
+    records['max_tile'] = maxTiles
+    records['moves'] = moves
+    records['wall_time'] = wallTimes
+    records['steps_per_sec'] = records['moves']/numpy.maximum(
+        records['wall_time'], 1e-9)
+    return records
+
+
+class GameLogger(ABC):
+    '''Abstract class for loggers of game records'''
+
+    def __init__(self, bufferSize=1024, flushInterval=10.0):
+        '''Initialize the logger
+        input:
+            bufferSize: Number of records buffered before they are written
+            flushInterval: Largest number of seconds records stay buffered'''
+        self.flushInterval = flushInterval
+        self._buffer = numpy.zeros(bufferSize, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._lastFlush = time.monotonic()
+
+    def log(self, score, maxTile, moves, wallTime):
+        '''Log one game
+        input:
+            score: Final score of the game
+            maxTile: Largest tile of the game (e.g. 2048)
+            moves: Number of moves of the game
+            wallTime: Seconds the game took'''
+        record = self._buffer[self._count]
+        record['score'] = score
+        record['max_tile'] = maxTile
+        record['moves'] = moves
+        record['wall_time'] = wallTime
+        record['steps_per_sec'] = moves/max(wallTime, 1e-9)
+        self._count += 1
+        self._flushIfDue()
+
+    def logRecords(self, records):
+        '''Log structured array of records (see makeRecords)'''
+        for start in range(0, len(records), len(self._buffer)):
+            chunk = records[start:start + len(self._buffer)]
+            if self._count + len(chunk) > len(self._buffer):
+                self.flush()
+            self._buffer[self._count:self._count + len(chunk)] = chunk
+            self._count += len(chunk)
+        self._flushIfDue()
+
+    def _flushIfDue(self):
+        '''Flush if the buffer is full or flushInterval has passed'''
+        if (self._count == len(self._buffer) or
+                time.monotonic() - self._lastFlush >= self.flushInterval):
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered records'''
+        if self._count:
+            self._write(self._buffer[:self._count].copy())
+            self._count = 0
+        self._lastFlush = time.monotonic()
+
+    @abstractmethod
+    def _write(self, records):
+        '''Write structured array of records'''
+        pass
+
+    def close(self):
+        '''Flush and close the logger'''
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryLogger(GameLogger):
+    '''Logger keeping its records in memory'''
+
+    def __init__(self, bufferSize=1024):
+        super().__init__(bufferSize, float('inf'))
+        self._chunks = []
+
+    def _write(self, records):
+        self._chunks.append(records)
+
+    def records(self):
+        '''Return structured array of all records logged so far'''
+        self.flush()
+        if not self._chunks:
+            return numpy.zeros(0, dtype=RECORD_DTYPE)
+        return numpy.concatenate(self._chunks)
+
+
+class CSVLogger(GameLogger):
+    '''Logger writing a CSV file with a header line'''
+
+    def __init__(self, fileName, mode='w', bufferSize=1024,
+                 flushInterval=10.0):
+        '''Initialize the logger
+        input:
+            fileName: File to write to
+            mode: 'w' to overwrite or 'a' to append to the file'''
+        super().__init__(bufferSize, flushInterval)
+        append = mode.startswith('a') and os.path.exists(fileName) and \
+            os.path.getsize(fileName) > 0
+        if append:
+            _checkHeader(fileName)
+        self._file = open(fileName, mode)
+        if not append:
+            self._file.write(CSV_HEADER + '\n')
+            self._file.flush()
+
+    def _write(self, records):
+        numpy.savetxt(self._file, records, fmt=_CSV_FORMAT, delimiter=',')
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class BinaryLogger(GameLogger):
+    '''Logger writing MAGIC followed by records of RECORD_DTYPE'''
+
+    def __init__(self, fileName, mode='w', bufferSize=1024,
+                 flushInterval=10.0):
+        '''Initialize the logger
+        input:
+            fileName: File to write to
+            mode: 'w' to overwrite or 'a' to append to the file'''
+        super().__init__(bufferSize, flushInterval)
+        append = mode.startswith('a') and os.path.exists(fileName) and \
+            os.path.getsize(fileName) > 0
+        if append:
+            _checkMagic(fileName)
+        self._file = open(fileName, 'ab' if append else 'wb')
+        if not append:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    def _write(self, records):
+        self._file.write(records.tobytes())
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+def _isBinary(fileName):
+    '''Return true if fileName is a binary log'''
+    with open(fileName, 'rb') as logFile:
+        return logFile.read(len(MAGIC)) == MAGIC
+
+
+def _checkHeader(fileName):
+    '''Raise ValueError if fileName is not a CSV log with a header line, e.g.
+    an old log with one score per line'''
+    with open(fileName) as logFile:
+        if logFile.readline().rstrip('\n') != CSV_HEADER:
+            raise ValueError(fileName + ' is not a CSV game log with a '
+                             'header, it cannot be appended to')
+
+
+def _checkMagic(fileName):
+    '''Raise ValueError if fileName is not a binary log'''
+    if not _isBinary(fileName):
+        raise ValueError(fileName + ' is not a binary game log')
+
+
+def openLogger(fileName, mode='w', format=None, **kwargs):
+    '''Open a logger writing to a file
+    input:
+        fileName: File to write to
+        mode: 'w' to overwrite or 'a' to append to the file
+        format: 'csv' or 'binary'. If None use binary for files ending in .bin
+                and CSV otherwise.
+        kwargs: Options of the logger (bufferSize, flushInterval)'''
+    if format is None:
+        format = 'binary' if str(fileName).endswith('.bin') else 'csv'
+    if format == 'csv':
+        return CSVLogger(fileName, mode, **kwargs)
+    if format == 'binary':
+        return BinaryLogger(fileName, mode, **kwargs)
+    raise ValueError('Unknown log format ' + str(format))
+
+
+def readLog(fileName, chunkSize=2**16):
+    '''Read a log written by a logger in chunks. Logs holding one score per
+    line, as written by earlier versions, are read as records with only the
+    score set.
+    input:
+        fileName: Log to read
+        chunkSize: Number of records per chunk
+    output: Generator of structured arrays of RECORD_DTYPE'''
+    if _isBinary(fileName):
+        records = numpy.memmap(fileName, dtype=RECORD_DTYPE, mode='r',
+                               offset=len(MAGIC))
+        for start in range(0, len(records), chunkSize):
+            yield numpy.array(records[start:start + chunkSize])
+        return
+    with open(fileName) as logFile:
+        first = logFile.readline()
+        scoresOnly = first.strip() != CSV_HEADER
+        lines = itertools.chain([first] if scoresOnly else [], logFile)
+        while True:
+            chunk = list(itertools.islice(lines, chunkSize))
+            if not chunk:
+                return
+            if scoresOnly:
+                records = numpy.zeros(len(chunk), dtype=RECORD_DTYPE)
+                records['score'] = numpy.loadtxt(chunk, dtype=numpy.int64,
+                                                 ndmin=1)
+            else:
+                records = numpy.loadtxt(chunk, dtype=RECORD_DTYPE,
+                                        delimiter=',', ndmin=1)
+            yield records
+
+
+def rollingAverage(chunks, window):
+    '''Rolling average over a sequence of chunks, computed without
+    concatenating them
+    input:
+        chunks: Iterable of 1D arrays
+        window: Window of the average
+    output: Array of the averages of every complete window'''
+    averages = []
+    carry = numpy.zeros(0)
+    for chunk in chunks:
+        values = numpy.concatenate([carry, numpy.asarray(chunk, dtype=float)])
+        if len(values) >= window:
+            sums = numpy.cumsum(numpy.concatenate([[0], values]))
+            averages.append((sums[window:] - sums[:-window])/window)
+        carry = values[max(0, len(values) - window + 1):] if window > 1 \
+            else values[:0]
+    if not averages:
+        return numpy.zeros(0)
+    return numpy.concatenate(averages)
@@ -22,6 +22,9 @@ setuptools.setup(
         'numpy',
         'opencv-python'
     ],
+    extras_require={
+        'render': ['Pillow']
+    },
     classifiers=[
         'Programming Language :: Python :: 3.6',
         'License :: OSI Approved :: MIT License',
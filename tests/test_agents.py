@@ -0,0 +1,33 @@
+'''Tests of the learning agents'''
+import numpy
+import pytest
+from rl2048player.agents import QAgent, SARSAAgent, TD0Agent
+from rl2048player.masks import Mask_rxcx4
+from rl2048player.persistence import saveTable
+
+
+def test_load_rejects_table_of_other_agent(tmp_path):
+    mask = Mask_rxcx4(compact=True)
+    fileName = str(tmp_path / 'q.table')
+    QAgent(mask, rng=0).save(fileName)
+    with pytest.raises(ValueError, match='QAgent'):
+        TD0Agent(mask, rng=0).load(fileName)
+    with pytest.raises(ValueError, match='QAgent'):
+        SARSAAgent(mask, rng=0).load(fileName)
+    agent = QAgent(mask, rng=1)
+    agent.load(fileName, mmap=True)
+    assert agent.tuples.shape == (mask.getMaxTupleNum(), 4)
+
+
+def test_load_rejects_table_of_wrong_shape(tmp_path):
+    mask = Mask_rxcx4(compact=True)
+    fileName = str(tmp_path / 'q.table')
+    agent = QAgent(mask, rng=0)
+    agent.save(fileName)
+    # Tables written before the class was recorded are checked by shape
+    saveTable(fileName, agent.tuples, agent='td0', mask=mask.getTag())
+    with pytest.raises(ValueError, match='shape'):
+        TD0Agent(mask, rng=0).load(fileName)
+    saveTable(fileName, numpy.zeros(mask.getMaxTupleNum()), agent='td0',
+              mask=mask.getTag())
+    TD0Agent(mask, rng=0).load(fileName)
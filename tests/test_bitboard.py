@@ -0,0 +1,28 @@
+'''Tests of the bitboard game engine'''
+import numpy
+from rl2048player.bitboard import (ROW_LEFT, ROW_LEFT_REWARD, ROW_RIGHT,
+                                   ROW_RIGHT_REWARD, MAX_TILE)
+from rl2048player.game import Game
+
+
+def _tiles(row):
+    return [(row >> shift) & 0xF for shift in (12, 8, 4, 0)]
+
+
+def _row(tiles):
+    return (tiles[0] << 12) | (tiles[1] << 8) | (tiles[2] << 4) | tiles[3]
+
+
+def test_row_tables_match_game():
+    # Game does not saturate, so leave out rows holding the largest tile
+    rows = [row for row in range(2**16) if MAX_TILE not in _tiles(row)]
+    for row in rows[::7]:
+        for table, rewards, reverse in ((ROW_LEFT, ROW_LEFT_REWARD, False),
+                                        (ROW_RIGHT, ROW_RIGHT_REWARD, True)):
+            tiles = _tiles(row)[::-1] if reverse else _tiles(row)
+            state = numpy.zeros((4, 4), dtype=numpy.int64)
+            state[0] = tiles
+            reward = Game(state)._do_action_left(state)
+            moved = list(state[0][::-1] if reverse else state[0])
+            assert table[row] == _row(moved)
+            assert rewards[row] == reward
@@ -0,0 +1,22 @@
+'''Tests of the weight stores'''
+import numpy
+from rl2048player.masks import Mask_rxcx4
+from rl2048player.stores import makeStore, measureThroughput
+
+
+def test_measureThroughput_leaves_table_unchanged():
+    mask = Mask_rxcx4(compact=True)
+    nums = mask.getTupleNums(numpy.random.RandomState(1).randint(
+        0, 12, (50, 4, 4))).reshape(-1)
+    for kind in ('dense', 'hash', 'hashed'):
+        for width in (None, 4):
+            store = makeStore(kind, mask.getMaxTupleNum(), width)
+            store[nums] = 1.5
+            before = numpy.array(store[nums])
+            dense = numpy.array(store) if kind == 'dense' else None
+            measured = measureThroughput(store, mask, numStates=50,
+                                         repeats=2)
+            assert measured['updates_per_sec'] > 0
+            assert numpy.array_equal(store[nums], before)
+            if dense is not None:
+                assert numpy.array_equal(store, dense)